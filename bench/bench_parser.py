@@ -0,0 +1,185 @@
+"""
+Бенчмарк парсера заявок на эталонном корпусе.
+
+Запуск из корня репозитория:
+    python -m bench.bench_parser                    # проверка + замер + сравнение с baseline
+    python -m bench.bench_parser --update-golden    # перезаписать эталонные ответы парсера
+    python -m bench.bench_parser --update-baseline  # сохранить текущий замер как baseline
+
+Сначала каждое сообщение корпуса прогоняется через parse_message,
+normalize_order_date и is_order_header, и результат сверяется с
+bench/golden.json. Потом меряем скорость: сообщений в секунду и p50/p99
+задержки одного вызова. Замер сравнивается с bench/baseline.json.
+Код выхода 1 — если разбор разошёлся с эталоном или скорость упала больше,
+чем на --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from bot.parser import is_order_header, normalize_order_date, parse_message
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(BENCH_DIR, "corpus", "orders.txt")
+GOLDEN_PATH = os.path.join(BENCH_DIR, "golden.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+FUNCTIONS = {
+    "parse_message": parse_message,
+    "normalize_order_date": normalize_order_date,
+    "is_order_header": is_order_header,
+}
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list[str]:
+    """Сообщения корпуса: блоки, разделённые строкой '==='."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    messages = []
+    for block in text.split("\n===\n"):
+        lines = [ln for ln in block.splitlines() if not ln.startswith("#")]
+        msg = "\n".join(lines).strip("\n")
+        if msg.strip() and msg.strip() != "===":
+            messages.append(msg)
+    return messages
+
+
+def run_golden(messages: list[str]) -> list[dict]:
+    return [
+        {name: fn(msg) for name, fn in FUNCTIONS.items()} | {"message": msg}
+        for msg in messages
+    ]
+
+
+def check_golden(messages: list[str]) -> list[str]:
+    """Возвращает список расхождений с эталоном (пустой — всё совпало)."""
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)
+    if len(golden) != len(messages):
+        return [f"в корпусе {len(messages)} сообщений, в эталоне {len(golden)} — обнови golden"]
+
+    errors = []
+    for i, (expected, actual) in enumerate(zip(golden, run_golden(messages))):
+        for name in FUNCTIONS:
+            if expected[name] != actual[name]:
+                first_line = actual["message"].splitlines()[0]
+                errors.append(f"#{i} «{first_line}»: {name} разошёлся с эталоном")
+    return errors
+
+
+def _percentile(sorted_samples: list[int], p: float) -> float:
+    idx = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[idx]
+
+
+def measure(messages: list[str], rounds: int) -> dict:
+    """Замер каждой функции: сообщений/сек, p50 и p99 одного вызова в микросекундах."""
+    result = {}
+    for name, fn in FUNCTIONS.items():
+        # прогрев
+        for msg in messages:
+            fn(msg)
+
+        samples = []
+        started = time.perf_counter_ns()
+        for _ in range(rounds):
+            for msg in messages:
+                t0 = time.perf_counter_ns()
+                fn(msg)
+                samples.append(time.perf_counter_ns() - t0)
+        total_s = (time.perf_counter_ns() - started) / 1e9
+
+        samples.sort()
+        result[name] = {
+            "msgs_per_sec": round(len(samples) / total_s, 1),
+            "p50_us": round(_percentile(samples, 50) / 1000, 2),
+            "p99_us": round(_percentile(samples, 99) / 1000, 2),
+            "mean_us": round(statistics.fmean(samples) / 1000, 2),
+        }
+    return result
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Регрессии: пропускная способность ниже baseline больше чем на tolerance."""
+    regressions = []
+    for name, cur in current.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        floor = base["msgs_per_sec"] * (1 - tolerance)
+        if cur["msgs_per_sec"] < floor:
+            regressions.append(
+                f"{name}: {cur['msgs_per_sec']} msg/s < {base['msgs_per_sec']} msg/s "
+                f"(baseline) - {tolerance:.0%}"
+            )
+    return regressions
+
+
+def _print_table(current: dict, baseline: dict | None) -> None:
+    print(f"{'функция':<22}{'msg/s':>12}{'p50, мкс':>12}{'p99, мкс':>12}{'vs base':>10}")
+    for name, r in current.items():
+        delta = ""
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            delta = f"{(r['msgs_per_sec'] / base['msgs_per_sec'] - 1):+.1%}"
+        print(f"{name:<22}{r['msgs_per_sec']:>12}{r['p50_us']:>12}{r['p99_us']:>12}{delta:>10}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк bot/parser.py на корпусе заявок")
+    ap.add_argument("--rounds", type=int, default=200, help="сколько раз прогнать корпус")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="допустимое падение msg/s (0.2 = 20%%)")
+    ap.add_argument("--update-golden", action="store_true")
+    ap.add_argument("--update-baseline", action="store_true")
+    args = ap.parse_args(argv)
+
+    messages = load_corpus()
+
+    if args.update_golden:
+        with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+            json.dump(run_golden(messages), f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        print(f"Эталон обновлён: {len(messages)} сообщений")
+        return 0
+
+    errors = check_golden(messages)
+    for e in errors:
+        print("❌", e)
+    if errors:
+        return 1
+    print(f"✅ Разбор совпал с эталоном ({len(messages)} сообщений)")
+
+    current = measure(messages, args.rounds)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "rounds": args.rounds,
+                "results": current,
+            }, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        _print_table(current, None)
+        print("Baseline обновлён")
+        return 0
+
+    baseline = None
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_table(current, baseline)
+
+    regressions = compare(current, baseline or {}, args.tolerance)
+    for r in regressions:
+        print("🐢", r)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
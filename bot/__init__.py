@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# настройки из .env нужны модулям уже при импорте
+load_dotenv()
@@ -0,0 +1,82 @@
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо–Корасик: все образцы ищутся за один проход по строке,
+    время не зависит от числа образцов (только от длины строки и числа совпадений).
+
+    find() возвращает значения образцов с семантикой «самое длинное совпадение
+    в каждой позиции»: если в одной позиции начинаются «жигул» и
+    «жигулевское светл», засчитывается только более длинный.
+    Совпадения, начинающиеся в разных позициях, засчитываются все
+    (в том числе пересекающиеся).
+    """
+
+    def __init__(self, patterns: dict[str, object]):
+        # бор: переходы, суффиксные ссылки и выходы (длина образца, значение),
+        # выходы включают образцы по цепочке суффиксных ссылок
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        own: list[tuple] = [()]
+
+        for pattern, value in patterns.items():
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    own.append(())
+                    self._goto[state][ch] = nxt
+                state = nxt
+            own[state] = ((len(pattern), value),)
+
+        # суффиксные ссылки — обходом в ширину
+        self._out: list[tuple] = list(own)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._out[state] = own[state] + self._out[self._fail[state]]
+            for ch, nxt in self._goto[state].items():
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                queue.append(nxt)
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def _step(self, state: int, ch: str) -> int:
+        """Переход по суффиксным ссылкам; результат запоминается в таблице переходов."""
+        goto, fail = self._goto, self._fail
+        cur = state
+        while True:
+            nxt = goto[cur].get(ch)
+            if nxt is not None or not cur:
+                break
+            cur = fail[cur]
+        nxt = nxt or 0
+        goto[state][ch] = nxt
+        return nxt
+
+    def find(self, text: str) -> set:
+        goto, out, step = self._goto, self._out, self._step
+        state = 0
+        # начало совпадения -> (длина, значение) самого длинного образца
+        best: dict[int, tuple] = {}
+        for i, ch in enumerate(text, 1):
+            nxt = goto[state].get(ch)
+            state = step(state, ch) if nxt is None else nxt
+            if out[state]:
+                for length, value in out[state]:
+                    start = i - length
+                    prev = best.get(start)
+                    if prev is None or prev[0] < length:
+                        best[start] = (length, value)
+        return {value for _, value in best.values()}
@@ -0,0 +1,189 @@
+import logging
+import re
+from decimal import Decimal
+
+import asyncpg
+
+from bot.aho_corasick import AhoCorasick
+
+log = logging.getLogger(__name__)
+
+# Правила товаров: как узнать товар в строке заявки и что о нём известно.
+# Хранятся в таблице product_rules; при загрузке компилируются в неизменяемый
+# снимок RuleSet (таблицы поиска + автомат признаков). Парсер читает снимок
+# через current(); /reload_rules подменяет его целиком. Отчёты от снимка не
+# зависят: акция и объём уже записаны в позициях заказа.
+
+# Встроенные правила: снимок до загрузки из БД и начальное заполнение
+# product_rules (миграция 7 в bot/init_db_pg.py).
+# (канон, основы — должны встретиться все, приоритет, кега л, ПЭТ л, штук в мешке, акция)
+DEFAULT_RULES = [
+    ("жигули", ["жигул"], 10, 50, None, None, None),
+    ("немецкое", ["немец"], 20, 30, None, None, "3+1"),
+    ("прага", ["праг"], 30, 30, None, None, "5+1"),
+    ("бархатное янтарное", ["бархат", "янтар"], 39, 30, None, None, None),
+    ("бархатное", ["бархат"], 40, 30, None, None, None),
+    ("пшеничное", ["пшенич"], 50, 30, None, None, "5+1"),
+    ("чешское", ["чешск"], 60, 30, None, None, None),
+    ("лимонад", ["лимонад"], 70, 50, None, None, None),
+    ("квас", ["квас"], 80, 50, None, None, None),
+    ("мохито", ["мохито"], 90, 50, None, None, None),
+    ("пэт 1л", [], 1000, None, Decimal("1"), 100, None),
+    ("пэт 1.5л", [], 1000, None, Decimal("1.5"), 60, None),
+    ("пэт 2л", [], 1000, None, Decimal("2"), 50, None),
+    ("пэт 3л", [], 1000, None, Decimal("3"), 40, None),
+]
+
+# слова разметки строки (не товары): тоже ловятся общим сканом
+GRAMMAR_FEATURES = {
+    "пэт": "pet", "бутылк": "pet",
+    "палет": "pal",
+    "акци": "promo",
+    "баллон": "cyl",
+}
+
+_PROMO_RE = re.compile(r"^(\d+)\+(\d+)$")
+# литры в строке ("60 л", "2л") — признак "liters"
+_LITERS_FEATURE_RE = re.compile(r"\d\s*л")
+# С какого числа признаков искать автоматом. На маленьком каталоге регулярка
+# (она работает в C) быстрее питоновского автомата, но её время растёт
+# с числом основ; автомат — нет. Перелом на замерах — 30–50 признаков.
+AUTOMATON_MIN_FEATURES = 32
+
+
+class RuleSet:
+    """
+    Скомпилированный снимок правил. Не меняется после создания,
+    поэтому его можно читать из любого места без блокировок.
+    """
+
+    def __init__(self, rules):
+        self.size = len(rules)
+        # правила с основами, по приоритету; основа -> номера правил, где она есть
+        self.drinks: tuple[tuple[frozenset, str], ...] = tuple(
+            (frozenset(stems), canon)
+            for canon, stems, *_ in sorted(rules, key=lambda r: r[2])
+            if stems
+        )
+        self._by_stem: dict[str, list[int]] = {}
+        for idx, (stems, _) in enumerate(self.drinks):
+            for stem in stems:
+                self._by_stem.setdefault(stem, []).append(idx)
+        self.keg_l: dict[str, int] = {r[0]: int(r[3]) for r in rules if r[3]}
+        self.bag_size: dict[str, int] = {r[0]: int(r[5]) for r in rules if r[5]}
+        self.promos: dict[str, str] = {r[0]: r[6].strip() for r in rules if r[6]}
+
+        # "1", "1.0", "1.5" -> канон ПЭТ (как пишут в заявках)
+        self.pet_by_liters: dict[str, str] = {}
+        for canon, _, _, _, pet_l, _, _ in rules:
+            if pet_l is None:
+                continue
+            v = Decimal(pet_l).normalize()
+            self.pet_by_liters[f"{v:f}"] = canon
+            if v == v.to_integral_value():
+                self.pet_by_liters[f"{v:.1f}"] = canon
+
+        # акция — строго "N+M": отчёт берёт множитель из самой строки (3+1 -> 4)
+        for promo in self.promos.values():
+            if not _PROMO_RE.match(promo):
+                raise ValueError(f"Акция должна быть вида 3+1: {promo!r}")
+
+        # признак в строке -> имя признака; основы товаров — сами себе имена.
+        # Поиск — «самое длинное совпадение в каждой позиции», пересекающиеся
+        # совпадения из разных позиций засчитываются все. Большой каталог ищет
+        # автомат Ахо–Корасик за один проход, сколько бы ни было основ;
+        # маленький — регулярка с той же семантикой: (?=(...)) в каждой позиции
+        # и альтернативы от длинных к коротким.
+        self.feature_names: dict[str, str] = dict(GRAMMAR_FEATURES)
+        for stem in self._by_stem:
+            self.feature_names[stem] = stem
+        self.automaton: AhoCorasick | None = None
+        self.features_re: re.Pattern | None = None
+        if len(self.feature_names) >= AUTOMATON_MIN_FEATURES:
+            self.automaton = AhoCorasick(self.feature_names)
+        else:
+            self.features_re = re.compile(
+                r"(?=("
+                + "|".join(re.escape(w) for w in sorted(self.feature_names, key=len, reverse=True))
+                + r"))"
+            )
+
+    def scan(self, text: str) -> set[str]:
+        """Признаки строки (в нижнем регистре, ё -> е): основы, пэт, акция, ..., liters."""
+        if self.automaton is not None:
+            found = self.automaton.find(text)
+        else:
+            found = set(map(self.feature_names.__getitem__, self.features_re.findall(text)))
+        if _LITERS_FEATURE_RE.search(text):
+            found.add("liters")
+        return found
+
+    def canon_from_features(self, found: set[str]) -> str | None:
+        """
+        Канон по найденным основам: правило подходит, если встретились все его основы.
+        Более полное правило побеждает те, что оно покрывает («бархат»+«янтар»
+        сильнее «бархат») — порядок правил для этого не нужен. Среди разных
+        товаров в одной строке выигрывает меньший priority.
+        Работа — по спискам правил найденных основ, а не по всему каталогу.
+        """
+        drinks = self.drinks
+        by_stem = self._by_stem
+        matched = [
+            idx
+            for feature in found if feature in by_stem
+            for idx in by_stem[feature] if drinks[idx][0] <= found
+        ]
+        if not matched:
+            return None
+        if len(matched) > 1:
+            matched = [
+                idx for idx in matched
+                if not any(drinks[other][0] > drinks[idx][0] for other in matched)
+            ]
+        return drinks[min(matched)][1]
+
+    def keg_uom(self, name: str) -> str:
+        size = self.keg_l.get(name)
+        return f"кега {size} л" if size else ""
+
+
+_CURRENT = RuleSet(DEFAULT_RULES)
+
+
+def current() -> RuleSet:
+    """Текущий снимок правил (берите один раз на сообщение/отчёт)."""
+    return _CURRENT
+
+
+async def load_rules(pool: asyncpg.Pool) -> RuleSet:
+    """
+    Читает product_rules и атомарно подменяет снимок.
+    Если правила не компилируются — бросает исключение, старый снимок остаётся.
+    """
+    global _CURRENT
+    rows = await pool.fetch(
+        """
+        SELECT canon, stems, priority, keg_l, pet_l, bag_size, promo
+        FROM product_rules
+        WHERE active
+        ORDER BY priority, canon
+        """
+    )
+    rules = [
+        (
+            r["canon"].strip().lower().replace("ё", "е"),
+            [s.strip().lower().replace("ё", "е") for s in (r["stems"] or []) if s.strip()],
+            r["priority"],
+            r["keg_l"],
+            r["pet_l"],
+            r["bag_size"],
+            r["promo"],
+        )
+        for r in rows
+    ]
+    if not rules:
+        raise ValueError("product_rules пуста — оставляю прежние правила")
+    snapshot = RuleSet(rules)
+    _CURRENT = snapshot
+    log.info("Правила товаров загружены: %s", snapshot.size)
+    return snapshot
@@ -1,40 +1,48 @@
-import os
-import psycopg2
+import re
+from datetime import date
 from decimal import Decimal
-from bot.product_db import get_or_create_product
-DB = os.getenv("DATABASE_URL")
 
+import asyncpg
+from bot.product_db import (
+    get_or_create_products,
+    invalidate_product_cache,
+    normalize,
+)
+from bot.parser import to_date
 
-def create_order(shop_id: int, chat_id: int, message_id: int | None = None, order_date: str | None = None) -> int:
-    """
-    Создаёт заказ и возвращает order_id
-    """
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
 
-    cur.execute(
-         """
-        INSERT INTO orders (shop_id, chat_id, message_id, order_date)
-        VALUES (%s, %s, %s, %s)
-        RETURNING id
-        """,
-        (shop_id, chat_id, message_id, order_date),
-    )
+ORDER_ITEM_COLUMNS = [
+    "order_id",
+    "product_id",
+    "qty_units",
+    "volume_l",
+    "pack_size",
+    "liter_total",
+    "is_additional",
+    "raw_text",
+    "uom",
+    "promo_info",
+    "comment",
+]
 
-    order_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
+# "кега 30 л" -> 30 литров в единице
+_KEG_UOM_RE = re.compile(r"кега\s*(\d+)")
 
-    return order_id
+# множитель по акции — из самой сохранённой строки "N+M" (3+1 -> 4 кеги, 5+1 -> 6),
+# а не по текущим правилам: после /reload_rules прошлые отчёты и итоги не меняются
+_PROMO_MULT_SQL = r"""
+    CASE WHEN btrim({promo}) ~ '^\d+\+\d+$'
+         THEN split_part(btrim({promo}), '+', 1)::int + split_part(btrim({promo}), '+', 2)::int
+         ELSE 1
+    END
+"""
 
 
-def add_order_item(order_id: int, item: dict):
+def _item_fields(item: dict) -> dict:
     """
-    Добавляет позицию в order_items.
-    item — словарь из parse_message()
+    Приводит позицию из parse_message() к полям order_items.
     """
-    name = (item.get("name") or item.get("title") or item.get("product") or "").strip() 
+    name = (item.get("name") or item.get("title") or item.get("product") or "").strip()
     raw_text = item.get("raw_text") or name or None
 
     # qty
@@ -43,68 +51,352 @@ def add_order_item(order_id: int, item: dict):
     # pack_size
     pack_size = int(item.get("pack_size") or item.get("pack") or 1)
 
-    # volume_l
+    uom = (item.get("uom") or "").strip() or None
+
+    # volume_l: если парсер не дал — берём объём кеги из ед. изм.
     volume_l = item.get("volume_l")
+    if volume_l is None and uom:
+        m = _KEG_UOM_RE.search(uom)
+        if m:
+            volume_l = int(m.group(1))
+    if volume_l is not None:
+        volume_l = Decimal(str(volume_l))
 
     # считаем итоговые литры
     liter_total = None
     if volume_l is not None:
-        liter_total = Decimal(str(volume_l)) * Decimal(pack_size) * Decimal(qty)
+        liter_total = volume_l * Decimal(pack_size) * Decimal(qty)
 
     # promo/comment
     promo_info = item.get("promo_info") or item.get("promo") or None
     comment = item.get("comment") or None
 
-    # product_id: если парсер не дал — создадим/найдём по имени
-    product_id = item.get("product_id")
-    if not product_id and name:
-        product_id = get_or_create_product(
-        display_name=name,
-        volume_l=volume_l,
-        pack_size=pack_size,
-        promo_type=str(promo_info) if promo_info else None
+    return {
+        "name": name,
+        "product_id": item.get("product_id"),
+        "qty_units": qty,
+        "volume_l": volume_l,
+        "pack_size": pack_size,
+        "liter_total": liter_total,
+        "raw_text": raw_text,
+        "uom": uom,
+        "promo_info": promo_info,
+        "comment": comment,
+    }
+
+
+async def save_order(
+    pool: asyncpg.Pool,
+    shop_id: int,
+    chat_id: int,
+    message_id: int | None,
+    order_date: str | date | None,
+    items: list[dict],
+) -> int:
+    """
+    Сохраняет заказ целиком в одной транзакции:
+    - один INSERT в orders,
+    - один запрос на все товары (поиск + создание недостающих),
+    - один COPY всех позиций в order_items.
+    Если что-то упало посередине — заказа в БД не будет вовсе.
+    Возвращает order_id.
+    """
+    order_ids = await save_orders(pool, chat_id, message_id, order_date, [(shop_id, items)])
+    return order_ids[0]
+
+
+async def save_orders(
+    pool: asyncpg.Pool,
+    chat_id: int,
+    message_id: int | None,
+    order_date: str | date | None,
+    orders: list[tuple[int, list[dict]]],
+) -> list[int]:
+    """
+    Сохраняет несколько заказов (пакетное сообщение на 20–50 магазинов)
+    одной транзакцией: заказы, товары всех заказов и все позиции —
+    по одному запросу/COPY на всё сообщение.
+    orders — список (shop_id, позиции из parse_message()).
+    Возвращает order_id в том же порядке.
+    """
+    batch = [(shop_id, [_item_fields(it) for it in items]) for shop_id, items in orders]
+    if not batch:
+        return []
+
+    try:
+        order_ids = await _save_orders_tx(pool, chat_id, message_id, order_date, batch)
+    except Exception:
+        # товары, созданные в откатившейся транзакции, не должны остаться в кэше
+        for _, fields in batch:
+            for f in fields:
+                if f["name"]:
+                    invalidate_product_cache(f["name"])
+        raise
+
+    return order_ids
+
+
+async def _insert_orders(conn: asyncpg.Connection, chat_id, message_id, orders: list[tuple[int, date]]) -> list[int]:
+    """orders — (shop_id, order_date). Возвращает id заказов в том же порядке."""
+    if len(orders) == 1:
+        order_id = await conn.fetchval(
+            """
+            INSERT INTO orders (shop_id, chat_id, message_id, order_date)
+            VALUES ($1, $2, $3, $4)
+            RETURNING id
+            """,
+            orders[0][0], chat_id, message_id, orders[0][1],
+        )
+        return [order_id]
+
+    # id берём из последовательности заранее, чтобы залить заказы одним COPY
+    rows = await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence('orders', 'id')) AS id FROM generate_series(1, $1)",
+        len(orders),
+    )
+    order_ids = [r["id"] for r in rows]
+    await conn.copy_records_to_table(
+        "orders",
+        records=[
+            (order_id, shop_id, chat_id, message_id, order_date)
+            for order_id, (shop_id, order_date) in zip(order_ids, orders)
+        ],
+        columns=["id", "shop_id", "chat_id", "message_id", "order_date"],
     )
+    return order_ids
 
-    # is_additional: если всё равно нет product_id — считаем как доп. позицию
-    is_additional = 0 if product_id else 1
 
-   
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
+async def _copy_items(
+    conn: asyncpg.Connection,
+    batch: list[tuple[int, date, list[dict]]],
+    add_totals: bool = True,
+) -> None:
+    """
+    batch — (order_id, дата заказа, поля позиций из _item_fields()).
+    Товары всех позиций находятся/создаются одним запросом, позиции — одним COPY,
+    итоги дня (daily_product_totals) — одним upsert (если add_totals).
+    """
+    product_ids = await get_or_create_products(conn, [
+        {
+            "display_name": f["name"],
+            "volume_l": f["volume_l"],
+            "pack_size": f["pack_size"],
+            "promo_type": str(f["promo_info"]) if f["promo_info"] else None,
+        }
+        for _, _, fields in batch
+        for f in fields
+        if not f["product_id"] and f["name"]
+    ])
 
-    cur.execute(
-        """
-        INSERT INTO order_items (
-            order_id,
-            product_id,
-            qty_units,
-            volume_l,
-            pack_size,
-            liter_total,
-            is_additional,
-            raw_text,
-            promo_info,
-            comment
+    records = []
+    totals = []
+    for order_id, order_date, fields in batch:
+        for f in fields:
+            product_id = f["product_id"] or product_ids.get(normalize(f["name"]))
+            if product_id:
+                totals.append((order_date, product_id, f))
+            records.append((
+                order_id,
+                product_id,
+                f["qty_units"],
+                f["volume_l"],
+                f["pack_size"],
+                f["liter_total"],
+                0 if product_id else 1,
+                f["raw_text"],
+                f["uom"],
+                f["promo_info"],
+                f["comment"],
+            ))
+
+    if records:
+        await conn.copy_records_to_table(
+            "order_items",
+            records=records,
+            columns=ORDER_ITEM_COLUMNS,
         )
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    if totals and add_totals:
+        await _add_daily_totals(conn, totals)
+
+
+async def _add_daily_totals(conn: asyncpg.Connection, totals: list[tuple[date, int, dict]]) -> None:
+    """
+    Прибавляет позиции к daily_product_totals (дата, товар, ед. изм.):
+    кол-во с учётом акции и литры — по тем же правилам, что и отчёт.
+    Вызывается в транзакции вставки позиций, поэтому итоги всегда
+    совпадают с order_items (импорт файла — см. add_order_totals).
+    """
+    await conn.execute(
+        f"""
+        INSERT INTO daily_product_totals AS t (order_date, product_id, uom, qty, liters)
+        SELECT
+            x.order_date,
+            x.product_id,
+            x.uom,
+            SUM(x.qty_units * x.promo_mult),
+            SUM(x.qty_units * x.promo_mult * COALESCE(x.volume_l, p.volume_l, 0) * x.pack_size)
+        FROM (
+            SELECT
+                u.order_date,
+                u.product_id,
+                COALESCE(u.uom, '') AS uom,
+                u.qty_units,
+                u.volume_l,
+                COALESCE(u.pack_size, 1) AS pack_size,
+                {_PROMO_MULT_SQL.format(promo="u.promo_info")} AS promo_mult
+            FROM unnest($1::date[], $2::int[], $3::text[], $4::int[], $5::numeric[], $6::int[], $7::text[])
+                AS u(order_date, product_id, uom, qty_units, volume_l, pack_size, promo_info)
+        ) x
+        LEFT JOIN products p ON p.id = x.product_id
+        GROUP BY x.order_date, x.product_id, x.uom
+        -- строки итогов блокируются в порядке ключа: встречные вставки не дают deadlock
+        ORDER BY x.order_date, x.product_id, x.uom
+        ON CONFLICT (order_date, product_id, uom) DO UPDATE
+        SET qty = t.qty + EXCLUDED.qty,
+            liters = t.liters + EXCLUDED.liters
+        """,
+        [d for d, _, _ in totals],
+        [product_id for _, product_id, _ in totals],
+        [f["uom"] for _, _, f in totals],
+        [f["qty_units"] for _, _, f in totals],
+        [f["volume_l"] for _, _, f in totals],
+        [f["pack_size"] for _, _, f in totals],
+        [f["promo_info"] for _, _, f in totals],
+    )
+
+
+async def _save_orders_tx(pool, chat_id, message_id, order_date, batch: list[tuple[int, list[dict]]]) -> list[int]:
+    order_date = to_date(order_date) or date.today()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            order_ids = await _insert_orders(
+                conn,
+                chat_id,
+                message_id,
+                [(shop_id, order_date) for shop_id, _ in batch],
+            )
+            await _copy_items(conn, [
+                (order_id, order_date, fields)
+                for order_id, (_, fields) in zip(order_ids, batch)
+            ])
+
+    return order_ids
+
+
+async def import_order_rows(
+    conn: asyncpg.Connection,
+    chat_id: int,
+    message_id: int | None,
+    groups: dict[tuple[int, date], list[dict]],
+    known_orders: dict[tuple[int, date], int],
+) -> None:
+    """
+    Очередная пачка строк импорта из файла (вызывается внутри транзакции).
+    groups — (shop_id, дата) -> позиции. Для новых пар (магазин, дата)
+    заказ создаётся, для уже встречавшихся в файле — позиции дописываются
+    в тот же заказ. known_orders пополняется новыми order_id.
+    Итоги дня здесь не трогаются — после загрузки файла их добавляет
+    add_order_totals().
+    """
+    new_keys = [key for key in groups if key not in known_orders]
+    if new_keys:
+        order_ids = await _insert_orders(conn, chat_id, message_id, new_keys)
+        known_orders.update(zip(new_keys, order_ids))
+
+    await _copy_items(conn, [
+        (known_orders[key], key[1], [_item_fields(it) for it in items])
+        for key, items in groups.items()
+    ], add_totals=False)
+
+
+async def add_order_totals(pool: asyncpg.Pool, order_ids: list[int]) -> None:
+    """
+    Прибавляет к daily_product_totals позиции уже сохранённых заказов,
+    одним запросом (своей короткой транзакцией). Так импорт файла не держит
+    строки итогов заблокированными, пока грузится весь файл.
+    """
+    if not order_ids:
+        return
+    await pool.execute(
+        f"""
+        INSERT INTO daily_product_totals AS t (order_date, product_id, uom, qty, liters)
+        SELECT
+            x.order_date,
+            x.product_id,
+            x.uom,
+            SUM(x.qty_units * x.promo_mult),
+            SUM(x.qty_units * x.promo_mult * x.liters_per_unit)
+        FROM (
+            SELECT
+                o.order_date,
+                oi.product_id,
+                COALESCE(oi.uom, '') AS uom,
+                oi.qty_units,
+                COALESCE(oi.volume_l, p.volume_l, 0) * COALESCE(oi.pack_size, 1) AS liters_per_unit,
+                {_PROMO_MULT_SQL.format(promo="oi.promo_info")} AS promo_mult
+            FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            JOIN products p ON p.id = oi.product_id
+            WHERE o.id = ANY($1::int[])
+        ) x
+        GROUP BY x.order_date, x.product_id, x.uom
+        ORDER BY x.order_date, x.product_id, x.uom
+        ON CONFLICT (order_date, product_id, uom) DO UPDATE
+        SET qty = t.qty + EXCLUDED.qty,
+            liters = t.liters + EXCLUDED.liters
         """,
-        (
-            order_id,
-            product_id,
-            qty,
-            volume_l,
-            pack_size,
-            liter_total,
-            is_additional,
-            raw_text,
-            promo_info,
-            comment,
-        ),
+        order_ids,
     )
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
+async def fetch_export_rows(pool: asyncpg.Pool, order_date: date) -> list[asyncpg.Record]:
+    """
+    Строки отчёта за дату, сгруппированные в Postgres:
+    Магазин + Товар + Ед. изм. + Акция + Комментарий.
+    Количество с учётом акции (3+1 -> x4, 5+1 -> x6) и литры считаются на сервере.
+    """
+    return await pool.fetch(
+        f"""
+        WITH lines AS (
+            SELECT
+                COALESCE(s.name, 'Без названия') AS shop,
+                COALESCE(p.display_name, oi.raw_text, '') AS product,
+                COALESCE(oi.uom, '') AS uom,
+                COALESCE(btrim(oi.promo_info), '') AS promo,
+                COALESCE(oi.comment, '') AS comment,
+                oi.qty_units,
+                COALESCE(oi.volume_l, p.volume_l, 0) * COALESCE(oi.pack_size, 1) AS liters_per_unit,
+                {_PROMO_MULT_SQL.format(promo="oi.promo_info")} AS promo_mult
+            FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            LEFT JOIN shops s ON s.id = o.shop_id
+            LEFT JOIN products p ON p.id = oi.product_id
+            WHERE o.order_date = $1
+        )
+        SELECT
+            shop, product, uom, promo, comment,
+            SUM(qty_units * promo_mult) AS qty,
+            SUM(qty_units * promo_mult * liters_per_unit) AS liters
+        FROM lines
+        GROUP BY shop, product, uom, promo, comment
+        ORDER BY shop, product
+        """,
+        order_date,
+    )
 
 
+async def fetch_product_totals(pool: asyncpg.Pool, order_date: date) -> list[asyncpg.Record]:
+    """
+    ИТОГО ПО ТОВАРАМ за дату из daily_product_totals:
+    чтение O(товаров), сколько бы магазинов ни заказало.
+    """
+    return await pool.fetch(
+        """
+        SELECT p.display_name AS product, t.uom, t.qty, t.liters
+        FROM daily_product_totals t
+        JOIN products p ON p.id = t.product_id
+        WHERE t.order_date = $1
+        ORDER BY p.display_name, t.uom
+        """,
+        order_date,
+    )
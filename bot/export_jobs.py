@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+import asyncpg
+
+from bot import report_cache
+from bot.exporter import export_orders_db
+
+log = logging.getLogger(__name__)
+
+# сколько отчётов собирается параллельно; остальные ждут в очереди executor
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+# thread — потоки (по умолчанию), process — отдельные процессы, не делят GIL с ботом
+EXPORT_EXECUTOR = os.getenv("EXPORT_EXECUTOR", "thread")
+
+_executor: Executor | None = None
+# (дата, версия) -> задача сборки; одинаковые запросы ждут одну и ту же задачу
+_inflight: dict[tuple[date, tuple], asyncio.Task] = {}
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if EXPORT_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+    return _executor
+
+
+async def request_export(pool: asyncpg.Pool, order_date: date) -> bytes | None:
+    """
+    Отчёт за дату. Если такой же отчёт уже собирается (та же дата и версия),
+    новая сборка не запускается — ждём готовый результат.
+    """
+    version = await report_cache.current_version(pool, order_date)
+    key = (order_date, version)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            export_orders_db(pool, order_date, executor=_get_executor(), version=version)
+        )
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        log.info("Отчёт на %s уже собирается — ждём его", order_date)
+
+    # shield: если один из ждущих отменится, сборку для остальных не прерываем
+    return await asyncio.shield(task)
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
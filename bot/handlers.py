@@ -1,14 +1,36 @@
+import asyncio
+import csv
+import logging
+import tempfile
+
+import asyncpg
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from aiogram.types import FSInputFile, ReplyKeyboardMarkup, KeyboardButton
-
-from bot.parser import parse_message, normalize_order_date, is_order_header
-from bot.exporter import record_order, export_orders
-from bot.shop_db import get_or_create_shop, list_shops
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    BufferedInputFile,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+
+from bot.parser import parse_message, normalize_order_date, is_order_header, to_date
+from bot.exporter import report_filename
+from bot.export_jobs import request_export
+from bot.importer import import_orders_file
+from bot.metrics import HANDLER_SECONDS, PARSE_SECONDS
+from bot import catalog, profiler
+from bot.outbox import outbox, reply, reply_document
+from bot.scheduler import scheduler
+from bot.state_store import FORM, ORDER_DATE
+from bot.shop_db import get_or_create_shop, get_or_create_shops, list_shops_page, add_shop_variant
+from bot.shop_db import normalize as normalize_shop
 
 import os
+from datetime import date
 from dotenv import load_dotenv
-from bot.db_orders import create_order, add_order_item
+from bot.db_orders import save_order, save_orders
 
 
 load_dotenv()
@@ -21,12 +43,21 @@ ADMIN_IDS = {
 
 
 router = Router()
+log = logging.getLogger(__name__)
+
+# фоновые задачи (отчёты), чтобы их не собрал GC до завершения
+_BACKGROUND: set[asyncio.Task] = set()
+
+# магазин, если название в заявке пустое после нормализации ("-----", "🍺🍺")
+UNKNOWN_SHOP = "неизвестный магазин"
 
 
-CURRENT_ORDER_DATE: dict[int, str] = {}
+def _shop_name(name: str | None) -> str:
+    return name if normalize_shop(name) else UNKNOWN_SHOP
 
-# Простое состояние диалога "Заявка": user_id -> dict
-FORM_STATE: dict[int, dict] = {}
+
+# Состояние диалогов (dp["dialogs"], см. bot/state_store.py):
+# FORM — шаги "Заявки": user_id -> dict, ORDER_DATE — дата заявок чата: chat_id -> str
 
 
 def main_keyboard() -> ReplyKeyboardMarkup:
@@ -43,7 +74,7 @@ def main_keyboard() -> ReplyKeyboardMarkup:
 
 @router.message(Command("whoami"))
 async def handle_whoami(msg: types.Message):
-    await msg.answer(f"Твой user_id: <code>{msg.from_user.id}</code>", parse_mode="HTML")
+    reply(msg, f"Твой user_id: <code>{msg.from_user.id}</code>", parse_mode="HTML")
 
 
 # === START / HELP ===
@@ -62,7 +93,12 @@ async def handle_start(msg: types.Message):
             "📊 Админ-команды:\n"
             "• /export_compact 06.11.2025 — Excel за дату\n"
             "• /export_compact — за сегодня\n"
-            "• /shops — список всех магазинов\n"
+            "• /shops — справочник магазинов по страницам, /shops маг — поиск по началу названия\n"
+            "• /shop_alias 12 Магнит Абая 12 — вариант названия магазина\n"
+            "• прислать .xlsx/.csv — импорт заявок (Магазин, Товар, Кол-во, Дата)\n"
+            "• /queues — очереди апдейтов по чатам\n"
+            "• /profile 200 — профиль следующих 200 апдейтов, /profile stop — досрочно\n"
+            "• /reload_rules — перечитать правила товаров (product_rules) без перезапуска\n"
             "• /whoami — твой user_id\n"
         )
     else:
@@ -74,76 +110,312 @@ async def handle_start(msg: types.Message):
             "Остальные команды доступны только администратору."
         )
 
-    await msg.answer(text, reply_markup=main_keyboard())
+    reply(msg, text, reply_markup=main_keyboard())
 
 
 # === EXPORT (только для админа) ===
 
 @router.message(Command("export_compact"))
-async def handle_export(msg: types.Message):
+async def handle_export(msg: types.Message, db: asyncpg.Pool):
     if msg.from_user.id not in ADMIN_IDS:
-        await msg.answer("Эта команда доступна только администратору.")
+        reply(msg, "Эта команда доступна только администратору.")
         return
 
     text = (msg.text or "").strip()
 
     parts = text.split(maxsplit=1)
     if len(parts) == 2:
-        order_date = parts[1].strip()
+        order_date = to_date(parts[1])
+        if not order_date:
+            reply(msg, "Формат: /export_compact 06.11.2025")
+            return
     else:
-        order_date = normalize_order_date("")
+        order_date = date.today()
 
-    path = export_orders(order_date)
-    if not path:
-        await msg.answer(f"На {order_date} пока нет заявок.")
+    # отчёт собирается в фоне: приём заявок из чатов его не ждёт
+    task = asyncio.create_task(_send_export(msg, db, order_date))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+
+
+async def _send_export(msg: types.Message, db: asyncpg.Pool, order_date):
+    label = order_date.strftime("%d.%m.%Y")
+    try:
+        data = await request_export(db, order_date)
+    except Exception:
+        log.exception("Не удалось собрать отчёт на %s", label)
+        reply(msg, f"⚠ Не удалось собрать отчёт на {label}.")
+        return
+
+    if not data:
+        reply(msg, f"На {label} пока нет заявок.")
         return
 
-    doc = FSInputFile(path)
-    await msg.answer_document(doc, caption=f"Отчёт по заявкам на {order_date}")
+    doc = BufferedInputFile(data, filename=report_filename(label))
+    reply_document(msg, doc, caption=f"Отчёт по заявкам на {label}")
 
 
-# === SHOPS (только для админа) ===
+# === ОЧЕРЕДИ (только для админа) ===
 
-@router.message(Command("shops"))
-async def handle_shops(msg: types.Message):
+@router.message(Command("queues"))
+async def handle_queues(msg: types.Message):
     if msg.from_user.id not in ADMIN_IDS:
-        await msg.answer("Эта команда доступна только администратору.")
+        reply(msg, "Эта команда доступна только администратору.")
         return
 
-    shops = list_shops()
-    if not shops:
-        await msg.answer("Справочник магазинов пуст.")
+    st = scheduler.stats()
+    lines = [
+        "📬 Очереди апдейтов:",
+        f"• активных чатов: {st['chats_active']}",
+        f"• ждут обработки: {st['pending']}",
+        f"• выполняются: {st['running']} из {scheduler.concurrency}",
+        f"• обработано: {st['processed']} (ошибок: {st['failed']})",
+        f"• макс. глубина очереди: {st['max_depth']}",
+    ]
+    hot = scheduler.hot_chats(5)
+    if hot:
+        lines.append("🔥 Горячие чаты:")
+        lines += [f"  {chat_id}: {depth}" for chat_id, depth in hot]
+    reply(msg, "\n".join(lines))
+
+
+# === ПРОФИЛИРОВАНИЕ (только для админа) ===
+
+@router.message(Command("profile"))
+async def handle_profile(msg: types.Message):
+    if msg.from_user.id not in ADMIN_IDS:
+        reply(msg, "Эта команда доступна только администратору.")
+        return
+
+    parts = (msg.text or "").split(maxsplit=1)
+    arg = parts[1].strip().lower() if len(parts) == 2 else "200"
+
+    if arg == "stop":
+        if not profiler.stop_profile():
+            reply(msg, "Профилирование сейчас не идёт.")
+        return
+
+    if not arg.isdigit() or int(arg) <= 0:
+        reply(msg, "Формат: /profile 200 — профиль следующих 200 апдейтов; /profile stop")
         return
 
-    text_lines = ["📒 Список магазинов:"]
+    async def report(text: str, updates: int, elapsed: float):
+        doc = BufferedInputFile(text.encode("utf-8"), filename="profile.txt")
+        reply_document(msg, doc, caption=f"⏱ Профиль: {updates} апдейтов за {elapsed:.0f} с")
+
+    if not profiler.start_profile(int(arg), report):
+        reply(msg, "⚠ Профилирование уже идёт (/profile stop — завершить).")
+        return
+    reply(
+        msg,
+        f"⏱ Профилирую следующие {min(int(arg), profiler.PROFILE_MAX_UPDATES)} апдейтов "
+        f"(не дольше {profiler.PROFILE_MAX_SECONDS // 60} мин).",
+    )
+
+
+# === ПРАВИЛА ТОВАРОВ (только для админа) ===
+
+@router.message(Command("reload_rules"))
+async def handle_reload_rules(msg: types.Message, db: asyncpg.Pool):
+    if msg.from_user.id not in ADMIN_IDS:
+        reply(msg, "Эта команда доступна только администратору.")
+        return
+
+    try:
+        rules = await catalog.load_rules(db)
+    except Exception as e:
+        log.exception("Не удалось перечитать правила товаров")
+        reply(msg, f"⚠ Правила не обновлены, работают прежние: {e}")
+        return
+
+    # сохранённые заявки и отчёты по ним от правил не зависят: акция и объём
+    # записаны в позициях, поэтому кэш отчётов не сбрасываем
+    reply(
+        msg,
+        f"✅ Правила товаров обновлены: {rules.size} "
+        f"(напитков: {len(rules.drinks)}, ПЭТ: {len(rules.bag_size)}, акций: {len(rules.promos)})",
+    )
+
+
+# === SHOPS (только для админа) ===
+
+# callback_data ограничен 64 байтами (не символами): курсор — только id
+# граничного магазина, "shops:next:<id>:" занимает до 22 байт, остальное — поиск
+SHOPS_PREFIX_MAX_BYTES = 40
+
+
+class ShopsPage(CallbackData, prefix="shops"):
+    dir: str  # "next" | "prev"
+    id: int
+    q: str = ""
+
+
+def _shops_query(text: str) -> str:
+    """Префикс поиска /shops, обрезанный до SHOPS_PREFIX_MAX_BYTES байт UTF-8."""
+    q = normalize_shop(text).encode()[:SHOPS_PREFIX_MAX_BYTES]
+    # обрезка могла попасть в середину символа — неполный хвост отбрасываем
+    return q.decode(errors="ignore").rstrip()
+
+
+async def _shops_page(db: asyncpg.Pool, q: str, after_id=None, before_id=None):
+    """Текст и клавиатура страницы /shops (None, None — если магазинов нет)."""
+    shops, more = await list_shops_page(db, after_id=after_id, before_id=before_id, prefix=q)
+    if not shops:
+        return None, None
+
+    # с курсора пришли из соседней страницы — значит, в ту сторону она есть
+    has_prev = more if before_id is not None else after_id is not None
+    has_next = more if before_id is None else True
+
+    title = f"📒 Магазины на «{q}»:" if q else "📒 Список магазинов:"
+    lines = [title]
     for s in shops:
         status = "🟢" if s["active"] else "🔴"
-        text_lines.append(f"{status} {s['id']}. {s['name']}  ({s['date']})")
+        added = s["date"].strftime("%d.%m.%Y") if s["date"] else "—"
+        lines.append(f"{status} {s['id']}. {s['name']}  ({added})")
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="◀️ Назад", callback_data=ShopsPage(dir="prev", id=shops[0]["id"], q=q).pack(),
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            text="Вперёд ▶️", callback_data=ShopsPage(dir="next", id=shops[-1]["id"], q=q).pack(),
+        ))
+    markup = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(lines), markup
+
+
+@router.message(Command("shops"))
+async def handle_shops(msg: types.Message, db: asyncpg.Pool):
+    if msg.from_user.id not in ADMIN_IDS:
+        reply(msg, "Эта команда доступна только администратору.")
+        return
+
+    parts = (msg.text or "").split(maxsplit=1)
+    q = _shops_query(parts[1]) if len(parts) == 2 else ""
 
-    result = "\n".join(text_lines)
-    if len(result) < 4000:
-        await msg.answer(result)
+    text, markup = await _shops_page(db, q)
+    if text is None:
+        reply(msg, f"Магазинов на «{q}» нет." if q else "Справочник магазинов пуст.")
+        return
+    reply(msg, text, reply_markup=markup)
+
+
+@router.callback_query(ShopsPage.filter())
+async def handle_shops_page(call: types.CallbackQuery, callback_data: ShopsPage, db: asyncpg.Pool):
+    if call.from_user.id not in ADMIN_IDS:
+        await call.answer("Только для администратора.", show_alert=True)
+        return
+
+    if callback_data.dir == "prev":
+        text, markup = await _shops_page(db, callback_data.q, before_id=callback_data.id)
     else:
-        chunk = []
-        for line in text_lines:
-            chunk.append(line)
-            if len("\n".join(chunk)) > 3000:
-                await msg.answer("\n".join(chunk))
-                chunk = []
-        if chunk:
-            await msg.answer("\n".join(chunk))
+        text, markup = await _shops_page(db, callback_data.q, after_id=callback_data.id)
+
+    if text is None or not isinstance(call.message, types.Message):
+        await call.answer("Дальше магазинов нет.")
+        return
+    await call.answer()
+    outbox.send(call.message.edit_text(text, reply_markup=markup))
+
+
+@router.message(Command("shop_alias"))
+async def handle_shop_alias(msg: types.Message, db: asyncpg.Pool):
+    if msg.from_user.id not in ADMIN_IDS:
+        reply(msg, "Эта команда доступна только администратору.")
+        return
+
+    parts = (msg.text or "").split(maxsplit=2)
+    if len(parts) < 3 or not parts[1].isdigit():
+        reply(msg, "Формат: /shop_alias <id магазина> <вариант названия>")
+        return
+
+    shop_id, variant = int(parts[1]), parts[2].strip()
+    if await add_shop_variant(db, shop_id, variant):
+        reply(msg, f"✅ «{variant}» теперь означает магазин {shop_id}.")
+    else:
+        reply(msg, "⚠ Магазин не найден или этот вариант уже привязан к другому магазину.")
+
+
+# === ИМПОРТ ЗАЯВОК ИЗ ФАЙЛА (только для админа) ===
+
+@router.message(F.document)
+async def handle_import(msg: types.Message, db: asyncpg.Pool, dialogs):
+    if msg.from_user.id not in ADMIN_IDS:
+        return
+
+    name = (msg.document.file_name or "").lower()
+    if not name.endswith((".xlsx", ".csv")):
+        reply(msg, "Для импорта нужен файл .xlsx или .csv (колонки: Магазин, Товар, Кол-во, Дата).")
+        return
+
+    # дата по умолчанию для строк без даты: из подписи, из чата или сегодня
+    default_date = (
+        to_date((msg.caption or "").strip())
+        or to_date(await dialogs.get(ORDER_DATE, msg.chat.id))
+        or date.today()
+    )
+
+    # импорт большого файла идёт в фоне: очередь чата его не ждёт
+    task = asyncio.create_task(_run_import(msg, db, name, default_date))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+
+
+async def _run_import(msg: types.Message, db: asyncpg.Pool, name: str, default_date):
+    suffix = os.path.splitext(name)[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "import" + suffix)
+        review_path = os.path.join(tmp, "review.csv")
+        reply(msg, "📥 Импорт начат…")
+        try:
+            await msg.bot.download(msg.document, destination=src)
+            with open(review_path, "w", encoding="utf-8-sig", newline="") as f:
+                report = await import_orders_file(
+                    db, src, msg.chat.id, msg.message_id, default_date,
+                    csv.writer(f, delimiter=";"),
+                )
+        except Exception:
+            log.exception("Не удалось импортировать %s", name)
+            reply(msg, "⚠ Импорт не удался, ничего не загружено.")
+            return
+
+        if report is None:
+            reply(msg, "⚠ Не нашёл строку заголовков: нужны колонки «Магазин» и «Товар».")
+            return
+
+        dates = ", ".join(d.strftime("%d.%m.%Y") for d in sorted(report.dates)) or "—"
+        reply(
+            msg,
+            "📥 Импорт завершён\n"
+            f"Строк загружено: {report.accepted}\n"
+            f"Заказов: {report.orders}, магазинов: {len(report.shops)}\n"
+            f"Даты: {dates}\n"
+            f"⚠ На проверку: {report.review}",
+        )
+        if report.review:
+            # файл уйдёт из очереди исходящих позже, чем удалится tmp — шлём байты
+            with open(review_path, "rb") as f:
+                review = f.read()
+            reply_document(
+                msg,
+                BufferedInputFile(review, filename="import_review.csv"),
+                caption="Строки, которые не удалось разобрать",
+            )
 
 
 # === FORM HANDLING (🧾 Заявка) ===
 
-async def handle_form_step(msg: types.Message, state: dict):
+async def handle_form_step(msg: types.Message, state: dict, db: asyncpg.Pool, dialogs):
     user_id = msg.from_user.id
     text = (msg.text or "").strip()
 
     # возможность отмены
     if text.lower() in {"отмена", "cancel"}:
-        FORM_STATE.pop(user_id, None)
-        await msg.answer("Ок, отменил 💛", reply_markup=main_keyboard())
+        await dialogs.delete(FORM, user_id)
+        reply(msg, "Ок, отменил 💛", reply_markup=main_keyboard())
         return
 
     step = state.get("step")
@@ -154,11 +426,13 @@ async def handle_form_step(msg: types.Message, state: dict):
         state["shop_name"] = shop_name
 
         # сохраняем в БД
-        shop_id = get_or_create_shop(shop_name)
+        shop_id = await get_or_create_shop(db, shop_name)
         state["shop_id"] = shop_id
 
         state["step"] = "date"
-        await msg.answer(
+        await dialogs.set(FORM, user_id, state)
+        reply(
+            msg,
             "На какую дату заявка? (например: 06.11.2025)\n"
             "Можно написать: сегодня",
         )
@@ -167,14 +441,19 @@ async def handle_form_step(msg: types.Message, state: dict):
     # 2 — выбираем дату
     if step == "date":
         if text.lower() == "сегодня" or not text:
-            order_date = normalize_order_date("")
+            order_date = date.today().strftime("%d.%m.%Y")
+        elif to_date(text):
+            order_date = to_date(text).strftime("%d.%m.%Y")
         else:
-            order_date = text
+            reply(msg, "Не понял дату 🤔 Напиши, например: 06.11.2025 или «сегодня».")
+            return
 
         state["order_date"] = order_date
         state["step"] = "items"
+        await dialogs.set(FORM, user_id, state)
 
-        await msg.answer(
+        reply(
+            msg,
             "Теперь пришли список позиций одним сообщением.\n"
             "Например:\n"
             "Жигули 3\n"
@@ -194,30 +473,26 @@ async def handle_form_step(msg: types.Message, state: dict):
 
         result = parse_message(synthetic_msg)
         if result.get("type") != "order":
-            await msg.answer("⚠ Не смог разобрать позиции. Попробуй ещё раз.")
-            FORM_STATE.pop(user_id, None)
+            reply(msg, "⚠ Не смог разобрать позиции. Попробуй ещё раз.")
+            await dialogs.delete(FORM, user_id)
             return
 
         items = result.get("items") or []
 
-        # 1) создаём заказ
-        order_id = create_order(
+        # сохраняем заказ с позициями одной транзакцией
+        await save_order(
+            db,
             shop_id=shop_id,
             chat_id=msg.chat.id,
             message_id=msg.message_id,
             order_date=order_date,
+            items=items,
         )
 
-        # 2) сохраняем позиции в БД
-        for item in items:
-            add_order_item(order_id, item)
-
-        # 3) старый экспорт (в память) — один раз, не в цикле
-        record_order(order_date, items, shop_id=shop_id)
+        await dialogs.delete(FORM, user_id)
 
-        FORM_STATE.pop(user_id, None)
-
-        await msg.answer(
+        reply(
+            msg,
             f"Заявка оформлена ✅\n"
             f"🏪 Магазин: {shop_name}\n"
             f"📅 Дата: {order_date}\n"
@@ -231,31 +506,43 @@ async def handle_form_step(msg: types.Message, state: dict):
 # === ОБРАБОТКА ТЕКСТА (кнопки + свободный формат) ===
 
 @router.message(F.text)
-async def handle_text(msg: types.Message):
+async def handle_text(msg: types.Message, db: asyncpg.Pool, dialogs):
     user_id = msg.from_user.id
     text = (msg.text or "").strip()
     # === СЛУЖЕБНОЕ СООБЩЕНИЕ: ПРИЁМ ЗАЯВОК ===
     if is_order_header(text):
         date = normalize_order_date(text)
         if date:
-            CURRENT_ORDER_DATE[msg.chat.id] = date
-            await msg.answer(f"📅 Принял. Дата заявок: {date}")
+            await dialogs.set(ORDER_DATE, msg.chat.id, date)
+
+        # заявки магазинов могут прийти в том же сообщении, что и шапка
+        with PARSE_SECONDS.time():
+            result = parse_message(text, batch=True)
+        if result.get("type") in {"order", "batch"}:
+            await _save_parsed(msg, db, dialogs, result)
+            return
+
+        if date:
+            reply(msg, f"📅 Принял. Дата заявок: {date}")
         else:
-            await msg.answer("📅 Принял сообщение о приёме заявок.")
+            reply(msg, "📅 Принял сообщение о приёме заявок.")
         return
 
     if not text:
         return
 
     # продолжаем форму
-    if user_id in FORM_STATE:
-        await handle_form_step(msg, FORM_STATE[user_id])
+    state = await dialogs.get(FORM, user_id)
+    if state:
+        with HANDLER_SECONDS.time("handle_form_step"):
+            await handle_form_step(msg, state, db, dialogs)
         return
 
     # кнопка заявки
     if text in {"🧾 Заявка", "Заявка"}:
-        FORM_STATE[user_id] = {"step": "shop"}
-        await msg.answer(
+        await dialogs.set(FORM, user_id, {"step": "shop"})
+        reply(
+            msg,
             "🧾 Новая заявка\n\n"
             "Шаг 1 — Как называется магазин?",
         )
@@ -263,7 +550,7 @@ async def handle_text(msg: types.Message):
 
     # цены
     if text in {"💸 Цены", "Цены"}:
-        await msg.answer("Прайс пока не подключён 💛")
+        reply(msg, "Прайс пока не подключён 💛")
         return
 
     # сторонние команды игнорируем
@@ -271,35 +558,66 @@ async def handle_text(msg: types.Message):
         return
 
     # ==== СВОБОДНЫЙ ФОРМАТ ЗАЯВКИ ====
-    result = parse_message(text)
-    if result.get("type") != "order":
-        await msg.answer("⚠ Я не смог понять сообщение как заявку.")
+    with PARSE_SECONDS.time():
+        result = parse_message(text, batch=True)
+    if result.get("type") not in {"order", "batch"}:
+        reply(msg, "⚠ Я не смог понять сообщение как заявку.")
         return
 
-    order_date = CURRENT_ORDER_DATE.get(
-    msg.chat.id,
-    result.get("order_date")
-    )
+    await _save_parsed(msg, db, dialogs, result)
+
+
+async def _save_parsed(msg: types.Message, db: asyncpg.Pool, dialogs, result: dict):
+    """Сохраняет разобранную заявку (или пакет заявок) и отвечает сводкой."""
+    order_date = await dialogs.get(ORDER_DATE, msg.chat.id) or result.get("order_date")
 
     if not order_date:
         order_date = normalize_order_date("")
-    
-    shop_name = result.get("shop") or "неизвестный магазин"
+
+    if result["type"] == "batch":
+        await handle_batch(msg, db, result["orders"], order_date)
+        return
+
+    shop_name = _shop_name(result.get("shop"))
     items = result.get("items") or []
 
-    shop_id = get_or_create_shop(shop_name)
+    shop_id = await get_or_create_shop(db, shop_name)
 
-    order_id = create_order(
+    await save_order(
+        db,
         shop_id=shop_id,
         chat_id=msg.chat.id,
         message_id=msg.message_id,
         order_date=order_date,
+        items=items,
     )
 
-    for item in items:
-        add_order_item(order_id, item)
-        
-    record_order(order_date, items, shop_id=shop_id)
+    reply(msg, f"{shop_name} ✓ {len(items)} позиций")
+
+
+async def handle_batch(msg: types.Message, db: asyncpg.Pool, orders: list[dict], order_date):
+    """Сообщение с заявками нескольких магазинов: всё одной транзакцией."""
+    names = [_shop_name(o["shop"]) for o in orders]
+    shop_ids = await get_or_create_shops(db, names)
+    batch = []
+    for name, o in zip(names, orders):
+        shop_id = shop_ids.get(normalize_shop(name)) or await get_or_create_shop(db, name)
+        batch.append((shop_id, o["items"]))
+
+    await save_orders(
+        db,
+        chat_id=msg.chat.id,
+        message_id=msg.message_id,
+        order_date=order_date,
+        orders=batch,
+    )
 
-    await msg.answer(f"{shop_name} ✓ {len(items)} позиций")
+    lines = [f"📦 Принято заявок: {len(orders)}"]
+    for o, (shop_id, items) in zip(orders, batch):
+        check = sum(1 for it in items if it.get("comment") == "нужна проверка")
+        line = f"{o['shop']} ✓ {len(items)}"
+        if check:
+            line += f" (⚠ {check} на проверку)"
+        lines.append(line)
 
+    reply(msg, "\n".join(lines))
@@ -0,0 +1,259 @@
+import asyncio
+import csv
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Iterator
+
+import asyncpg
+from openpyxl import load_workbook
+
+from bot.db_orders import add_order_totals, import_order_rows
+from bot.parser import parse_line, to_date
+from bot.product_db import invalidate_product_cache
+from bot.shop_db import forget_shops, get_or_create_shops, normalize as normalize_shop
+
+log = logging.getLogger(__name__)
+
+# сколько строк файла обрабатывается за один проход (одна пачка = один COPY)
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", "1000"))
+
+# заголовки колонок -> поле
+COLUMN_ALIASES = {
+    "shop": {"магазин", "точка", "клиент", "shop"},
+    "product": {"товар", "наименование", "продукт", "позиция", "product"},
+    "qty": {"кол-во", "количество", "кол во", "qty"},
+    "date": {"дата", "дата заявки", "date"},
+    "comment": {"комментарий", "примечание", "comment"},
+}
+
+REVIEW_HEADER = ["Строка", "Причина", "Магазин", "Товар", "Кол-во", "Дата"]
+
+
+@dataclass
+class ImportReport:
+    accepted: int = 0
+    review: int = 0
+    orders: int = 0
+    shops: set = field(default_factory=set)
+    dates: set = field(default_factory=set)
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _iter_csv(path: str) -> Iterator[list]:
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _iter_xlsx(path: str) -> Iterator[tuple]:
+    # read_only: строки читаются потоком, весь лист в память не грузится
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_sheet_rows(path: str) -> Iterator:
+    if path.lower().endswith(".csv"):
+        return _iter_csv(path)
+    return _iter_xlsx(path)
+
+
+def _map_header(row) -> dict[str, int] | None:
+    columns = {}
+    for idx, value in enumerate(row):
+        title = _cell_text(value).lower().replace("ё", "е").rstrip(":.")
+        for key, aliases in COLUMN_ALIASES.items():
+            if title in aliases and key not in columns:
+                columns[key] = idx
+    if "shop" in columns and "product" in columns:
+        return columns
+    return None
+
+
+def _find_header(rows: Iterator, max_lines: int = 20) -> tuple[dict[str, int] | None, int]:
+    """
+    Ищет строку заголовков в первых max_lines строках (выполняется в отдельном
+    потоке: первая строка xlsx — это ещё и load_workbook).
+    Возвращает (колонки или None, номер строки заголовков).
+    """
+    line_no = 0
+    for row in rows:
+        line_no += 1
+        columns = _map_header(row)
+        if columns:
+            return columns, line_no
+        if line_no >= max_lines:
+            break
+    return None, line_no
+
+
+def _row_date(value, default: date) -> date | None:
+    if value is None or value == "":
+        return default
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return to_date(_cell_text(value))
+
+
+def parse_row(row, columns: dict[str, int], default_date: date):
+    """
+    Одна строка таблицы -> (магазин, дата, позиция) или (None, причина).
+    Товар проходит ту же канонизацию, что и текстовые заявки
+    (parse_line по текущему снимку правил bot/catalog.py).
+    """
+    def col(key):
+        idx = columns.get(key)
+        return row[idx] if idx is not None and idx < len(row) else None
+
+    shop = _cell_text(col("shop"))
+    product = _cell_text(col("product"))
+    qty = _cell_text(col("qty"))
+    # "-", "—", "???" — после нормализации от названия ничего не остаётся
+    if not normalize_shop(shop):
+        return None, "нет магазина"
+    if not product:
+        return None, "нет товара"
+    if qty and not qty.isdigit():
+        return None, "непонятное количество"
+    if qty and int(qty) == 0:
+        return None, "нулевое количество"
+
+    order_date = _row_date(col("date"), default_date)
+    if order_date is None:
+        return None, "непонятная дата"
+
+    item = None
+    if qty and any(ch.isdigit() for ch in product):
+        # число уже в самом товаре: "Жигули 50 л" — одна кега 50 л,
+        # тогда кол-во берём из колонки; "Жигули 100 л" + колонка — неясно сколько
+        item = parse_line(product, shop)
+        if item is not None and item["comment"] != "нужна проверка":
+            if item["qty"] != 1:
+                return None, "количество и в товаре, и в колонке"
+            item["qty"] = int(qty)
+        else:
+            item = None
+    if item is None:
+        item = parse_line(f"{product} {qty}" if qty else product, shop)
+    if item is None or item["comment"] == "нужна проверка":
+        return None, "товар не распознан"
+
+    comment = _cell_text(col("comment"))
+    if comment:
+        item["comment"] = f"{item['comment']} {comment}".strip()
+    return (shop, order_date, item), None
+
+
+def _read_batch(rows: Iterator, columns: dict[str, int], default_date: date, start_line: int, size: int):
+    """Читает и разбирает следующую пачку строк (выполняется в отдельном потоке)."""
+    accepted, review = [], []
+    line_no = start_line
+    for row in rows:
+        line_no += 1
+        if not any(_cell_text(v) for v in row):
+            continue
+        parsed, reason = parse_row(row, columns, default_date)
+        if parsed:
+            accepted.append(parsed)
+        else:
+            review.append([line_no, reason] + [
+                _cell_text(row[columns[k]]) if columns.get(k) is not None and columns[k] < len(row) else ""
+                for k in ("shop", "product", "qty", "date")
+            ])
+        if len(accepted) + len(review) >= size:
+            break
+    return accepted, review, line_no
+
+
+async def import_orders_file(
+    pool: asyncpg.Pool,
+    path: str,
+    chat_id: int,
+    message_id: int | None,
+    default_date: date,
+    review_writer,
+) -> ImportReport | None:
+    """
+    Загружает заявки из .xlsx/.csv в orders/order_items.
+    Файл читается потоком, пачками по IMPORT_BATCH_ROWS строк (открытие файла
+    и разбор — в потоке, чтобы не держать event loop), каждая пачка — один COPY;
+    весь файл — одна транзакция, итоги дня — короткой транзакцией после неё.
+    Строки, которые не удалось разобрать, не грузятся, а пишутся в review_writer
+    (csv.writer) для проверки.
+    None — если в файле не нашлась строка заголовков (Магазин, Товар).
+    """
+    rows = iter_sheet_rows(path)
+    report = ImportReport()
+
+    # строка заголовков — в первых строках файла
+    columns, line_no = await asyncio.to_thread(_find_header, rows)
+    if not columns:
+        return None
+
+    review_writer.writerow(REVIEW_HEADER)
+    known_orders: dict[tuple[int, date], int] = {}
+    # магазины, созданные в транзакции импорта: при откате их нет в БД
+    created_shops: set[int] = set()
+
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                while True:
+                    accepted, review, line_no = await asyncio.to_thread(
+                        _read_batch, rows, columns, default_date, line_no, IMPORT_BATCH_ROWS,
+                    )
+                    if not accepted and not review:
+                        break
+
+                    for r in review:
+                        review_writer.writerow(r)
+                    report.review += len(review)
+                    if not accepted:
+                        continue
+
+                    # магазины — в той же транзакции: откат импорта откатит и их
+                    shop_ids = await get_or_create_shops(
+                        conn, [shop for shop, _, _ in accepted], created=created_shops,
+                    )
+                    groups: dict[tuple[int, date], list[dict]] = {}
+                    for shop, order_date, item in accepted:
+                        key = (shop_ids[normalize_shop(shop)], order_date)
+                        groups.setdefault(key, []).append(item)
+                        report.shops.add(key[0])
+                        report.dates.add(order_date)
+
+                    await import_order_rows(conn, chat_id, message_id, groups, known_orders)
+                    report.accepted += len(accepted)
+    except Exception:
+        # товары и магазины из откатившейся транзакции не должны остаться в кэше
+        invalidate_product_cache()
+        forget_shops(created_shops)
+        raise
+
+    # итоги дня — после загрузки, чтобы не блокировать их на весь импорт;
+    # заказы уже в БД, поэтому сбой здесь импорт не отменяет
+    try:
+        await add_order_totals(pool, list(known_orders.values()))
+    except Exception:
+        log.exception("Итоги дня не обновлены для %d заказов импорта", len(known_orders))
+
+    report.orders = len(known_orders)
+    return report
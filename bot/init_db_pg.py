@@ -1,5 +1,8 @@
 import asyncpg
 
+from bot.catalog import DEFAULT_RULES
+from bot.shop_db import normalize as normalize_shop, split_variants
+
 CREATE_TABLES_SQL = """
 CREATE TABLE IF NOT EXISTS shops (
     id SERIAL PRIMARY KEY,
@@ -42,11 +45,295 @@ CREATE TABLE IF NOT EXISTS order_items (
     promo_info TEXT,
     comment TEXT
 );
+
+CREATE TABLE IF NOT EXISTS dialog_state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+PRODUCT_RULES_SQL = """
+-- как узнать товар в строке заявки и что о нём известно (bot/catalog.py)
+CREATE TABLE IF NOT EXISTS product_rules (
+    canon TEXT PRIMARY KEY,                 -- каноническое название
+    stems TEXT[] NOT NULL DEFAULT '{}',     -- основы, которые должны встретиться все
+    priority INTEGER NOT NULL DEFAULT 100,  -- меньше — проверяется раньше
+    keg_l INTEGER,                          -- кега 30/50 л
+    pet_l NUMERIC(4,2),                     -- ПЭТ: объём бутылки
+    bag_size INTEGER,                       -- ПЭТ: штук в мешке
+    promo TEXT,                             -- акция вида 3+1
+    active BOOLEAN NOT NULL DEFAULT true,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+async def _create_product_rules(conn: asyncpg.Connection) -> None:
+    """
+    Миграция 7: таблица product_rules, заполненная catalog.DEFAULT_RULES —
+    правила описаны в одном месте, встроенный снимок и таблица не разойдутся.
+    """
+    await conn.execute(PRODUCT_RULES_SQL)
+    await conn.executemany(
+        """
+        INSERT INTO product_rules (canon, stems, priority, keg_l, pet_l, bag_size, promo)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (canon) DO NOTHING
+        """,
+        DEFAULT_RULES,
+    )
+
+
+async def _renormalize_shops(conn: asyncpg.Connection) -> None:
+    """
+    Миграция 8: shops.normalized по нынешнему shop_db.normalize (без пунктуации).
+    Магазины, которые теперь дают один ключ («Магнит.» и «Магнит»), сливаются
+    в самый ранний: заказы переносятся на него, имена и варианты остальных
+    становятся его вариантами.
+    """
+    rows = await conn.fetch("SELECT id, name, normalized, variants FROM shops ORDER BY id")
+
+    groups: dict[str, list] = {}
+    for r in rows:
+        # ключ, пустой после normalize ("..."), не трогаем — сливать не с чем
+        key = normalize_shop(r["normalized"]) or r["normalized"]
+        groups.setdefault(key, []).append(r)
+
+    merged = 0
+    for key, group in groups.items():
+        keep, dups = group[0], group[1:]
+        if dups:
+            dup_ids = [r["id"] for r in dups]
+            variants = split_variants(keep["variants"])
+            seen = {key} | {normalize_shop(v) for v in variants}
+            for r in dups:
+                for alias in (r["name"], *split_variants(r["variants"])):
+                    alias_key = normalize_shop(alias)
+                    if alias_key and alias_key not in seen:
+                        seen.add(alias_key)
+                        variants.append(alias)
+            await conn.execute(
+                "UPDATE orders SET shop_id = $1 WHERE shop_id = ANY($2::int[])",
+                keep["id"], dup_ids,
+            )
+            await conn.execute("DELETE FROM shops WHERE id = ANY($1::int[])", dup_ids)
+            await conn.execute(
+                "UPDATE shops SET variants = $2 WHERE id = $1",
+                keep["id"], ";".join(variants) or None,
+            )
+            merged += len(dups)
+        if keep["normalized"] != key:
+            await conn.execute("UPDATE shops SET normalized = $2 WHERE id = $1", keep["id"], key)
+
+    if merged:
+        print(f"✅ init_db: слито магазинов-дублей: {merged}")
+
+
+# Миграции схемы: (версия, описание, SQL или async-функция от соединения).
+# Применённые версии пишутся в schema_version, каждая миграция выполняется
+# в своей транзакции.
+# Новые изменения схемы — только новой миграцией в конец списка.
+MIGRATIONS = [
+    (1, "базовые таблицы", CREATE_TABLES_SQL),
+    (2, "уникальный products.name_norm", """
+-- name_norm должен быть уникальным (upsert товаров через ON CONFLICT).
+-- Перед созданием индекса схлопываем уже накопившиеся дубли.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'products_name_norm_key') THEN
+        UPDATE order_items oi
+        SET product_id = d.keep_id
+        FROM (
+            SELECT id, min(id) OVER (PARTITION BY name_norm) AS keep_id
+            FROM products
+        ) d
+        WHERE oi.product_id = d.id AND d.id <> d.keep_id;
+
+        DELETE FROM products p
+        USING products keep
+        WHERE keep.name_norm = p.name_norm AND keep.id < p.id;
+
+        CREATE UNIQUE INDEX products_name_norm_key ON products (name_norm);
+    END IF;
+END $$;
+"""),
+    (3, "схема под код: даты DATE, колонки позиций", r"""
+-- orders.order_date: типизированная дата (если колонку уже добавляли текстом — конвертируем).
+-- Текст читается как parser.to_date: Д.М[.ГГ[ГГ]], разделители . - /,
+-- без года — текущий год, ГГ — 20ГГ; несуществующая дата -> NULL.
+CREATE OR REPLACE FUNCTION pg_temp.order_date_from_text(s TEXT) RETURNS DATE
+LANGUAGE plpgsql AS $f$
+DECLARE
+    m TEXT[];
+    y INTEGER;
+BEGIN
+    m := regexp_match(s, '^\s*(\d{1,2})[./-](\d{1,2})(?:[./-](\d{2,4}))?\s*$');
+    IF m IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF m[3] IS NULL THEN
+        y := extract(year FROM current_date);
+    ELSIF length(m[3]) = 2 THEN
+        y := 2000 + m[3]::int;
+    ELSE
+        y := m[3]::int;
+    END IF;
+    RETURN make_date(y, m[2]::int, m[1]::int);
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$f$;
+
+DO $$
+DECLARE
+    nulled INTEGER;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'orders' AND column_name = 'order_date' AND data_type = 'text'
+    ) THEN
+        SELECT count(*) INTO nulled
+        FROM orders
+        WHERE order_date IS NOT NULL AND pg_temp.order_date_from_text(order_date) IS NULL;
+        IF nulled > 0 THEN
+            RAISE NOTICE 'orders.order_date: дата не распознана в % заказах, станет NULL', nulled;
+        END IF;
+
+        ALTER TABLE orders ALTER COLUMN order_date TYPE DATE
+            USING pg_temp.order_date_from_text(order_date);
+    END IF;
+END $$;
+DROP FUNCTION pg_temp.order_date_from_text(TEXT);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_date DATE;
+
+-- order_items: liters_total -> liter_total, остальные колонки пишет db_orders
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'order_items' AND column_name = 'liters_total'
+    ) AND NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'order_items' AND column_name = 'liter_total'
+    ) THEN
+        ALTER TABLE order_items RENAME COLUMN liters_total TO liter_total;
+    END IF;
+END $$;
+ALTER TABLE order_items
+    ADD COLUMN IF NOT EXISTS liter_total NUMERIC(10,2),
+    ADD COLUMN IF NOT EXISTS volume_l NUMERIC(10,2),
+    ADD COLUMN IF NOT EXISTS pack_size INTEGER DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS is_additional INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS raw_text TEXT,
+    ADD COLUMN IF NOT EXISTS uom TEXT;
+
+-- shops.data_added -> date_added (так колонку читает list_shops)
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'shops' AND column_name = 'data_added'
+    ) THEN
+        ALTER TABLE shops RENAME COLUMN data_added TO date_added;
+    END IF;
+END $$;
+ALTER TABLE shops ADD COLUMN IF NOT EXISTS date_added TIMESTAMP DEFAULT now();
+"""),
+    (4, "индексы горячих запросов", """
+-- отчёт за дату и заказы магазина за дату
+CREATE INDEX IF NOT EXISTS orders_order_date_shop_idx ON orders (order_date, shop_id);
+-- позиции заказа (JOIN в отчёте, ON DELETE CASCADE)
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id);
+-- products.name_norm покрыт уникальным products_name_norm_key (миграция 2)
+"""),
+    (5, "итоги дня по товарам", """
+-- ИТОГО ПО ТОВАРАМ за дату: кол-во с учётом акции и литры,
+-- пополняется в транзакции вставки позиций (db_orders._add_daily_totals)
+CREATE TABLE IF NOT EXISTS daily_product_totals (
+    order_date DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    uom TEXT NOT NULL DEFAULT '',
+    qty NUMERIC NOT NULL DEFAULT 0,
+    liters NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (order_date, product_id, uom)
+);
+
+-- итоги по уже накопленным заказам
+INSERT INTO daily_product_totals (order_date, product_id, uom, qty, liters)
+SELECT
+    o.order_date,
+    oi.product_id,
+    COALESCE(oi.uom, ''),
+    SUM(oi.qty_units * m.mult),
+    SUM(oi.qty_units * m.mult * COALESCE(oi.volume_l, p.volume_l, 0) * COALESCE(oi.pack_size, 1))
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.id
+JOIN products p ON p.id = oi.product_id
+CROSS JOIN LATERAL (
+    SELECT CASE btrim(oi.promo_info) WHEN '3+1' THEN 4 WHEN '5+1' THEN 6 ELSE 1 END AS mult
+) m
+WHERE o.order_date IS NOT NULL
+GROUP BY o.order_date, oi.product_id, COALESCE(oi.uom, '')
+ON CONFLICT DO NOTHING;
+"""),
+    (6, "индексы постраничного /shops", """
+-- листание по (name, id) и поиск по префиксу normalized (диапазон в порядке байтов)
+CREATE INDEX IF NOT EXISTS shops_name_id_idx ON shops (name, id);
+CREATE INDEX IF NOT EXISTS shops_normalized_c_id_idx ON shops ((normalized COLLATE "C"), id);
+"""),
+    (7, "правила товаров", _create_product_rules),
+    (8, "shops.normalized без пунктуации", _renormalize_shops),
+]
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
 """
 
+# ключ advisory-lock: два процесса бота не накатывают миграции одновременно
+MIGRATION_LOCK_KEY = 4221017
+
+
+def _print_notice(conn: asyncpg.Connection, message) -> None:
+    # RAISE NOTICE из миграций (sqlstate 00000); «already exists, skipping» не печатаем
+    if message.sqlstate == "00000":
+        print(f"ℹ init_db: {message.message}")
+
+
 async def init_db(pool: asyncpg.Pool) -> None:
+    """Накатывает недостающие миграции из MIGRATIONS."""
     async with pool.acquire() as conn:
-        await conn.execute(CREATE_TABLES_SQL)
-    print("✅ init_db: таблицы проверены/созданы")
+        await conn.execute(SCHEMA_VERSION_SQL)
+        conn.add_log_listener(_print_notice)
+        try:
+            await _apply_migrations(conn)
+        finally:
+            conn.remove_log_listener(_print_notice)
+    print("✅ init_db: схема актуальна")
 
 
+async def _apply_migrations(conn: asyncpg.Connection) -> None:
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_KEY)
+        applied = {
+            r["version"] for r in await conn.fetch("SELECT version FROM schema_version")
+        }
+        for version, description, sql in MIGRATIONS:
+            if version in applied:
+                continue
+            async with conn.transaction():
+                if callable(sql):
+                    await sql(conn)
+                else:
+                    await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    version, description,
+                )
+            print(f"✅ init_db: миграция {version} — {description}")
@@ -2,12 +2,20 @@ import asyncio
 import logging
 import os
 
-import asyncpg
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
 
+from bot import catalog, export_jobs, metrics
 from bot.handlers import router
+from bot.outbox import outbox
+from bot.scheduler import scheduler
 from bot.init_db_pg import init_db
+from bot.product_db import warm_product_cache
+from bot.shop_db import load_shop_index
+from bot.state_store import create_state_store
+from bot.webhook import run_webhook
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -15,9 +23,25 @@ logging.basicConfig(level=logging.INFO)
 TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-bot = Bot(token=TOKEN)
+# polling — long polling (по умолчанию), webhook — aiohttp-сервер за балансировщиком
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or None
+# свой Bot API сервер (локальный telegram-bot-api или фейковый для проверок)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or None
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=TOKEN, session=session)
 dp = Dispatcher()
 dp.include_router(router)
+# апдейты одного чата — по очереди, разных чатов — параллельно
+dp.update.outer_middleware(scheduler)
+# время каждого обработчика -> /metrics
+dp.message.middleware(metrics.HandlerMetrics())
+dp.callback_query.middleware(metrics.HandlerMetrics())
 
 async def main():
     print("╔══════════════════════════════╗")
@@ -32,14 +56,40 @@ async def main():
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL не найден в .env / Railway variables")
 
-    pool = await asyncpg.create_pool(DATABASE_URL)
+    pool = await metrics.create_pool(DATABASE_URL)  # asyncpg-пул с таймингами запросов
     await init_db(pool)
+    try:
+        await catalog.load_rules(pool)
+    except Exception:
+        logging.exception("Правила товаров не загружены, работаю на встроенных")
+    cached = await warm_product_cache(pool)
+    logging.info("Каталог товаров в кэше: %s", cached)
+    shops = await load_shop_index(pool)
+    logging.info("Магазинов в индексе: %s", shops)
 
     dp["db"] = pool  # чтобы хэндлеры могли достать pool
+    dp["dialogs"] = create_state_store(pool)  # состояние диалогов (🧾 Заявка, дата заявок)
+    metrics_runner = await metrics.start_metrics_server()
 
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(
+                dp,
+                bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                public_url=WEBHOOK_URL,
+            )
+        else:
+            await dp.start_polling(bot)
     finally:
+        await scheduler.wait_idle(timeout=10)
+        await outbox.wait_idle(timeout=10)
+        export_jobs.shutdown()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await pool.close()
 
 if __name__ == "__main__":
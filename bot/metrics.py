@@ -0,0 +1,259 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable
+
+import asyncpg
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# локальный HTTP-эндпоинт /metrics в формате Prometheus; пусто или 0 — выключен
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or "0")
+
+# границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_REGISTRY: list = []
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """
+    Гистограмма с метками, как prometheus_client.Histogram, но без зависимостей:
+    на каждую комбинацию меток — счётчики по корзинам, сумма и количество.
+    """
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values) -> None:
+        s = self._series.get(label_values)
+        if s is None:
+            # [счётчики корзин..., +Inf] , сумма
+            s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        s[0][bisect_left(self.buckets, value)] += 1
+        s[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in sorted(self._series.items()):
+            acc = 0
+            for le, n in zip(self.buckets + ("+Inf",), counts):
+                acc += n
+                labels = _labels_text(self.labels, values, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {acc}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, values)} {acc}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        _REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for values, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, values)} {v}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается в момент запроса /metrics: fn() -> число или {метка: число}."""
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Any], label: str | None = None):
+        self.name = name
+        self.doc = doc
+        self.fn = fn
+        self.label = label
+        _REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for k, v in sorted(value.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(k)}"}} {v}')
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === метрики бота ===
+
+HANDLER_SECONDS = Histogram("favobot_handler_seconds", "Время обработчика", ("handler",))
+HANDLER_ERRORS = Counter("favobot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+UPDATE_SECONDS = Histogram(
+    "favobot_update_seconds",
+    "От приёма апдейта до конца обработки (очередь чата + обработчик) — задержка ответа на заявку",
+)
+QUEUE_WAIT_SECONDS = Histogram("favobot_queue_wait_seconds", "Ожидание апдейта в очереди чата")
+DB_SECONDS = Histogram("favobot_db_seconds", "Время запроса к Postgres", ("op",))
+DB_ERRORS = Counter("favobot_db_errors_total", "Ошибки запросов к Postgres", ("op",))
+POOL_WAIT_SECONDS = Histogram("favobot_db_pool_wait_seconds", "Ожидание свободного соединения в пуле")
+PARSE_SECONDS = Histogram("favobot_parse_seconds", "Разбор текста заявки (parse_message)")
+EXPORT_SECONDS = Histogram("favobot_export_seconds", "Сборка отчёта по этапам", ("stage",))
+
+
+# === обработчики aiogram ===
+
+class HandlerMetrics(BaseMiddleware):
+    """
+    Inner middleware (dp.message / dp.callback_query): время каждого
+    обработчика с меткой по имени функции (handle_text, handle_export, ...).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+
+# === Postgres ===
+
+def _timed(op: str):
+    method = getattr(asyncpg.Connection, op)
+
+    async def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(op)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, op)
+
+    wrapper.__name__ = op
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class MeteredConnection(asyncpg.Connection):
+    """Соединение, которое меряет каждый запрос (по типу вызова: fetch, execute, copy...)."""
+
+    execute = _timed("execute")
+    executemany = _timed("executemany")
+    fetch = _timed("fetch")
+    fetchrow = _timed("fetchrow")
+    fetchval = _timed("fetchval")
+    copy_records_to_table = _timed("copy_records_to_table")
+
+
+class _TimedAcquire:
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        try:
+            return await self._ctx.__aenter__()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+    def __await__(self):
+        return self.__aenter__().__await__()
+
+
+class MeteredPool(asyncpg.Pool):
+    """Пул, который меряет ожидание соединения (pool.fetch и т.п. тоже идут через acquire)."""
+
+    def acquire(self, *, timeout=None):
+        return _TimedAcquire(super().acquire(timeout=timeout))
+
+
+async def create_pool(dsn: str, **kwargs) -> asyncpg.Pool:
+    """asyncpg.create_pool с метриками запросов и ожидания пула."""
+    params = dict(
+        min_size=10,
+        max_size=10,
+        max_queries=50000,
+        max_inactive_connection_lifetime=300.0,
+        loop=None,
+        connection_class=MeteredConnection,
+        record_class=asyncpg.Record,
+    )
+    params.update(kwargs)
+    return await MeteredPool(dsn, **params)
+
+
+# === HTTP ===
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Поднимает GET /metrics; None — если порт не задан или занят."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        log.warning("Метрики не подняты на %s:%s: %s", host, port, e)
+        await runner.cleanup()
+        return None
+    log.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
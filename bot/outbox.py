@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+
+from bot.metrics import Counter, Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+# лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+# сколько запросов к Bot API в полёте одновременно
+OUTBOX_MAX_INFLIGHT = int(os.getenv("OUTBOX_MAX_INFLIGHT", "16"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+
+SEND_SECONDS = Histogram("favobot_outbox_send_seconds", "Отправка сообщения в Bot API", ("method",))
+SEND_WAIT_SECONDS = Histogram("favobot_outbox_wait_seconds", "От постановки в очередь до начала отправки")
+RETRY_AFTER = Counter("favobot_outbox_retry_after_total", "Ответов 429 (retry_after) от Telegram")
+SEND_FAILED = Counter("favobot_outbox_failed_total", "Сообщений, которые не удалось отправить", ("method",))
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity подряд.
+    reserve() сразу резервирует токен и говорит, сколько ждать до него,
+    поэтому конкуренты встают в очередь, а не будят друг друга.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        """retry_after от Telegram: ничего не отправлять seconds секунд."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle_after(self) -> float:
+        """Через сколько секунд ведро снова полное (и его можно забыть)."""
+        now = time.monotonic()
+        self._refill(now)
+        return max((self.capacity - self.tokens) / self.rate, self.blocked_until - now, 0.0)
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений.
+
+    Обработчики не ждут сеть: send() кладёт метод Bot API (msg.answer(...),
+    msg.answer_document(...)) в очередь его чата и сразу возвращается.
+    Сообщения одного чата уходят по порядку; темп ограничен ведром чата
+    (личка/группа) и общим ведром бота, одновременно в полёте не больше
+    max_inflight запросов. На 429 очередь чата ждёт retry_after и повторяет.
+    """
+
+    def __init__(self, max_inflight: int = OUTBOX_MAX_INFLIGHT):
+        self.global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._queues: dict[Any, deque] = {}
+        self._buckets: dict[Any, TokenBucket] = {}
+        self._workers: dict[Any, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, method: TelegramMethod, bot: Bot | None = None) -> asyncio.Future:
+        """
+        Ставит метод в очередь. Future завершится результатом Bot API
+        (или None, если отправить не удалось) — ждать его не обязательно.
+        """
+        bot = bot or method._bot
+        chat_id = getattr(method, "chat_id", None)
+        fut = asyncio.get_running_loop().create_future()
+
+        q = self._queues.get(chat_id)
+        if q is None:
+            q = self._queues[chat_id] = deque()
+        q.append((method, bot, fut, time.perf_counter()))
+
+        if chat_id not in self._workers:
+            task = asyncio.create_task(self._drain(chat_id, q))
+            self._workers[chat_id] = task
+        return fut
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, int) and chat_id < 0 or isinstance(chat_id, str)
+            rate = OUTBOX_GROUP_RATE if group else OUTBOX_CHAT_RATE
+            bucket = self._buckets[chat_id] = TokenBucket(rate, OUTBOX_CHAT_BURST)
+        return bucket
+
+    async def _drain(self, chat_id, q: deque) -> None:
+        bucket = self._chat_bucket(chat_id)
+        try:
+            while q:
+                method, bot, fut, queued = q[0]
+                result = await self._deliver(chat_id, bucket, method, bot, queued)
+                q.popleft()
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._workers.pop(chat_id, None)
+            if not q:
+                self._queues.pop(chat_id, None)
+            # ведро чата храним, пока оно не наполнится: иначе новый всплеск обойдёт лимит
+            asyncio.get_running_loop().call_later(bucket.idle_after(), self._forget, chat_id, bucket)
+
+    def _forget(self, chat_id, bucket: TokenBucket) -> None:
+        if chat_id not in self._queues and self._buckets.get(chat_id) is bucket:
+            del self._buckets[chat_id]
+
+    async def _deliver(self, chat_id, bucket: TokenBucket, method: TelegramMethod, bot: Bot, queued: float):
+        name = type(method).__name__
+        for attempt in range(OUTBOX_MAX_RETRIES + 1):
+            wait = bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            wait = self.global_bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+
+            async with self._inflight:
+                if attempt == 0:
+                    SEND_WAIT_SECONDS.observe(time.perf_counter() - queued)
+                start = time.perf_counter()
+                try:
+                    result = await bot(method)
+                except TelegramRetryAfter as e:
+                    RETRY_AFTER.inc()
+                    log.warning("Flood control в чате %s: ждём %s с", chat_id, e.retry_after)
+                    bucket.block(e.retry_after)
+                    continue
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    log.warning("Bot API недоступен (%s), попытка %s", e, attempt + 1)
+                    bucket.block(min(2 ** attempt, 30))
+                    continue
+                except Exception:
+                    log.exception("Не удалось отправить %s в чат %s", name, chat_id)
+                    break
+                finally:
+                    SEND_SECONDS.observe(time.perf_counter() - start, name)
+            self.sent += 1
+            return result
+
+        self.failed += 1
+        SEND_FAILED.inc(name)
+        return None
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def wait_idle(self, timeout: float | None = None) -> None:
+        """Дождаться отправки уже поставленных сообщений (при остановке бота)."""
+        tasks = list(self._workers.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+outbox = Outbox()
+
+Gauge("favobot_outbox_pending", "Сообщений в исходящих очередях", outbox.pending)
+
+
+def reply(msg, text: str, **kwargs) -> asyncio.Future:
+    """msg.answer(...) через очередь исходящих."""
+    return outbox.send(msg.answer(text, **kwargs))
+
+
+def reply_document(msg, document, **kwargs) -> asyncio.Future:
+    """msg.answer_document(...) через очередь исходящих."""
+    return outbox.send(msg.answer_document(document, **kwargs))
@@ -2,12 +2,14 @@ import re
 from datetime import date
 from typing import Optional
 
+from bot.catalog import RuleSet, current as current_rules
+from bot.shop_db import normalize as normalize_shop
+
+HEADER_PAT = re.compile(r"заявк[аи]?\s+на\s+\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}")
+
 #Проверяем не служебное ли это сообщение
 def is_order_header(text: str) -> bool:
-    text = text.lower()
-    return bool(
-        re.search(r"заявк[аи]?\s+на\s+\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}", text)
-    )
+    return bool(HEADER_PAT.search(text.lower()))
 # Простейшая нормализация даты из текста "заявки на ..."
 DATE_PAT = re.compile(r"(?:заявк[аи]\s+на\s+)(\d{1,2}\.\d{1,2}(?:\.\d{2,4})?)", re.I)
 
@@ -29,76 +31,68 @@ def normalize_order_date(text: str) -> Optional[str]:
     mth = str(int(mth)).zfill(2)
     return f"{d}.{mth}.{y}"
 
-# кеги
-KEG_30 = {"бархатное", "бархатное янтарное", "немецкое", "прага", "чешское", "пшеничное"}
-KEG_50 = {"жигули", "квас", "лимонад", "мохито"}
 
-PET_BAGS = {
-    "пэт 1л": 100,
-    "пэт 1.5л": 60,
-    "пэт 2л": 50,
-    "пэт 3л": 40,
-}
+# "06.11.2025", "6.11.25", "06.11" -> date
+DATE_VALUE_PAT = re.compile(r"^\s*(\d{1,2})[.\-/](\d{1,2})(?:[.\-/](\d{2,4}))?\s*$")
+
+def to_date(text) -> Optional[date]:
+    """Дата заявки из строки ДД.ММ[.ГГ[ГГ]]; None — если это не дата."""
+    if text is None or isinstance(text, date):
+        return text
+    m = DATE_VALUE_PAT.match(text)
+    if not m:
+        return None
+    d, mth, y = m.groups()
+    if not y:
+        y = date.today().year
+    elif len(y) == 2:
+        y = "20" + y
+    try:
+        return date(int(y), int(mth), int(d))
+    except ValueError:
+        return None
+
+# === Движок разбора строки ===
+# Знания о товарах (основы названий, кеги, ПЭТ, акции) — в снимке правил
+# bot/catalog.py: он компилируется из product_rules один раз при загрузке.
+# Каждая строка сканируется сканером снимка (на большом каталоге — автомат
+# Ахо–Корасик), который за один проход собирает все признаки: основы напитков,
+# ПЭТ, паллеты, литры, акция, баллон.
+# Дальше проверяются только те правила, признаки которых в строке есть.
+
+_PRICE_RE = re.compile(r"по\s*(\d+)")
+_PET_RE = re.compile(r"(пэт|бутылк[аи]?)\s*([\d.,]+)\s*л?\s*[-–—]?\s*(\d+)?")
+_PAL1_RE = re.compile(r"(\d+)\s+пал(е|е)т[аоы]?\s+(.+)")
+_PAL2_RE = re.compile(r"(.+?)\s+(\d+)\s+пал(е|е)т[аоы]?")
+_LITERS_RE = re.compile(r"(\d+)\s*л")
+_BASIC_RE = re.compile(r"^(.+?)\s+(\d+)$")
+_DIGITS_RE = re.compile(r"(\d+)")
+
+
+def _canon_drink(s: str, rules: RuleSet | None = None) -> str | None:
+    rules = rules or current_rules()
+    return rules.canon_from_features(rules.scan(s.lower().replace("ё", "е")))
+
 
+def _canon_pet(ltr: str, rules: RuleSet) -> str | None:
+    return rules.pet_by_liters.get(ltr.replace(",", "."))
 
-def _canon_drink(s: str) -> str | None:
-    t = s.lower()
-    t = t.replace("ё", "е")
-    if "жигул" in t:
-        return "жигули"
-    if "немец" in t:
-        return "немецкое"
-    if "праг" in t:
-        return "прага"
-    if "бархат" in t and "янтар" in t:
-        return "бархатное янтарное"
-    if "бархат" in t:
-        return "бархатное"
-    if "пшенич" in t:
-        return "пшеничное"
-    if "чешск" in t:
-        return "чешское"
-    if "лимонад" in t:
-        return "лимонад"
-    if "квас" in t:
-        return "квас"
-    if "мохито" in t:
-        return "мохито"
-    return None
-
-
-def _canon_pet(ltr: str) -> str | None:
-    ltr = ltr.replace(",", ".")
-    if ltr in ("1", "1.0"):
-        return "пэт 1л"
-    if ltr in ("1.5", "1,5"):
-        return "пэт 1.5л"
-    if ltr in ("2", "2.0"):
-        return "пэт 2л"
-    if ltr in ("3", "3.0"):
-        return "пэт 3л"
-    return None
-
-
-def _qty_from_liters(line: str):
+
+def _qty_from_liters(line: str, base: str | None = None, rules: RuleSet | None = None):
     """
     'Бархатное 60 л' -> (2, 'бархатное', 'кега 30 л')
     'Жигули 50 л' -> (1, 'жигули', 'кега 50 л')
     """
+    rules = rules or current_rules()
     t = line.lower()
-    m = re.search(r"(\d+)\s*л", t)
+    m = _LITERS_RE.search(t)
     if not m:
         return None
     liters = int(m.group(1))
-    base = _canon_drink(t) or "бархатное"
-    if base == "жигули" or base in {"квас", "лимонад", "мохито"}:
-        size = 50
-        uom = "кега 50 л"
-    else:
-        size = 30
-        uom = "кега 30 л"
+    base = base or _canon_drink(t, rules) or "бархатное"
+    size = rules.keg_l.get(base) or 30
     qty = max(1, round(liters / size))
-    return qty, base, uom
+    return qty, base, f"кега {size} л"
 
 
 STOP_LINES = {
@@ -109,86 +103,71 @@ STOP_LINES = {
     "здравствуйте",
     "ок",
     "окей",
+    "💰",
 }
 
 
-def parse_message(text: str, current_shop: str | None = None, order_date: str | None = None):
+def _item(shop, name, uom="", qty=1, promo="", comment=""):
+    return {
+        "shop": shop,
+        "name": name,
+        "uom": uom,
+        "qty": qty,
+        "promo": promo,
+        "comment": comment,
+    }
+
+
+def parse_line(raw: str, shop: str | None = None, rules: RuleSet | None = None) -> dict | None:
     """
-    Простая, но рабочая логика:
-    - первая строка сообщения = название магазина
-    - остальные строки = позиции
+    Разбирает одну строку заявки в позицию.
+    None — строку нужно пропустить (эмодзи, «спасибо» и т.п.).
+    Нераспознанная строка возвращается с комментарием «нужна проверка».
+    rules — снимок правил товаров (по умолчанию текущий).
     """
-    if not text:
-        return {"type": "unknown"}
+    rules = rules or current_rules()
+    s = raw.strip()
+    s_lower = s.lower()
 
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    if not lines:
-        return {"type": "unknown"}
-
-    # первая строка — магазин
-    shop = lines[0]
-    # иногда в первой строке могут написать "заявки на 06.11 ..." — отфильтруем
-    if "заявк" in shop.lower() and "на" in shop.lower() and len(lines) > 1:
-        shop = lines[1]
-        lines = lines[1:]
-    else:
-        lines = lines[1:]
+    # игнор чистых эмодзи и стоп-строк
+    if not any(ch.isalpha() or ch.isdigit() for ch in s):
+        return None
+    if s_lower in STOP_LINES:
+        return None
 
-    if not order_date:
-        order_date = normalize_order_date(text)
+    comment = ""
 
-    items = []
+    # вынести 'по 485' в комментарий
+    m_price = _PRICE_RE.search(s_lower)
+    if m_price:
+        comment = f"по {m_price.group(1)}"
+        s_lower = s_lower.replace(m_price.group(0), "").strip()
 
-    for raw in lines:
-        s = raw.strip()
-        s_lower = s.lower()
+    # if 'замена' — это отметим как комментарий
+    if "замена" in s_lower:
+        comment = (comment + " замена").strip()
+        s_lower = s_lower.replace("замена", "").strip()
 
-        # игнор чистых эмодзи и стоп-строк
-        if not any(ch.isalpha() or ch.isdigit() for ch in s):
-            continue
-        if s_lower in STOP_LINES or s_lower == "💰":
-            continue
+    # один проход по строке: все признаки сразу
+    found = rules.scan(s_lower.replace("ё", "е"))
 
-        comment = ""
-        promo = ""
-        qty = None
-        uom = ""
-
-        # вынести 'по 485' в комментарий
-        m_price = re.search(r"по\s*(\d+)", s_lower)
-        if m_price:
-            comment = (comment + f"по {m_price.group(1)}").strip()
-            s_lower = s_lower.replace(m_price.group(0), "").strip()
-
-        # if 'замена' — это отметим как комментарий
-        if "замена" in s_lower:
-            comment = (comment + " замена").strip()
-            s_lower = s_lower.replace("замена", "").strip()
-
-        # ПЭТ/бутылки 2л / 1,5л и т.д.
-        # варианты: "Пэт 2л-1", "Пэт 1,5 л - 2", "Бутылки 2л - 2"
-        m_pet = re.search(r"(пэт|бутылк[аи]?)\s*([\d.,]+)\s*л?\s*[-–—]?\s*(\d+)?", s_lower)
+    # ПЭТ/бутылки 2л / 1,5л и т.д.
+    # варианты: "Пэт 2л-1", "Пэт 1,5 л - 2", "Бутылки 2л - 2"
+    if "pet" in found:
+        m_pet = _PET_RE.search(s_lower)
         if m_pet:
-            ltr = m_pet.group(2)
-            canon = _canon_pet(ltr)
+            canon = _canon_pet(m_pet.group(2), rules)
             if canon:
                 qty = int(m_pet.group(3)) if m_pet.group(3) else 1
-                bag_size = PET_BAGS.get(canon, 0)
+                bag_size = rules.bag_size.get(canon, 0)
                 uom = f"меш {bag_size} шт" if bag_size else "меш"
-                items.append({
-                    "shop": shop,
-                    "name": canon,
-                    "uom": uom,
-                    "qty": qty,
-                    "promo": "",
-                    "comment": comment,
-                })
-                continue
-
-        # паллеты Павлодар стекло:
-        # "2 паллета павлодар стекло" или "павлодар стекло 2 паллета"
-        m_pal1 = re.search(r"(\d+)\s+пал(е|е)т[аоы]?\s+(.+)", s_lower)
-        m_pal2 = re.search(r"(.+?)\s+(\d+)\s+пал(е|е)т[аоы]?", s_lower)
+                return _item(shop, canon, uom, qty, comment=comment)
+
+    # паллеты Павлодар стекло:
+    # "2 паллета павлодар стекло" или "павлодар стекло 2 паллета"
+    if "pal" in found:
+        m_pal1 = _PAL1_RE.search(s_lower)
+        m_pal2 = None if m_pal1 else _PAL2_RE.search(s_lower)
         if m_pal1 or m_pal2:
             if m_pal1:
                 qty = int(m_pal1.group(1))
@@ -197,110 +176,156 @@ def parse_message(text: str, current_shop: str | None = None, order_date: str |
                 qty = int(m_pal2.group(2))
                 tail = m_pal2.group(1)
             if "павлодар" in tail and "стекло" in tail:
-                items.append({
-                    "shop": shop,
-                    "name": "павлодарское стекло 0.45л",
-                    "uom": "палл 20 шт",
-                    "qty": qty,
-                    "promo": "",
-                    "comment": comment,
-                })
-                continue
-
-        # 'Бархатное 60 л', 'Жигули 50 л'
-        mlit = _qty_from_liters(s_lower)
+                return _item(shop, "павлодарское стекло 0.45л", "палл 20 шт", qty, comment=comment)
+
+    base = rules.canon_from_features(found)
+
+    # 'Бархатное 60 л', 'Жигули 50 л'
+    if "liters" in found:
+        mlit = _qty_from_liters(s_lower, base, rules)
         if mlit:
-            qty, base, uom = mlit
-            items.append({
-                "shop": shop,
-                "name": base,
-                "uom": uom,
-                "qty": qty,
-                "promo": "",
-                "comment": comment,
-            })
-            continue
+            qty, name, uom = mlit
+            return _item(shop, name, uom, qty, comment=comment)
 
-        # Немецкое 1, Бархатное 3, Жигули 2
-        m_basic = re.search(r"^(.+?)\s+(\d+)$", s_lower)
-        if m_basic:
-            name_part = m_basic.group(1).strip()
-            qty = int(m_basic.group(2))
-            base = _canon_drink(name_part)
-            if base:
-                name = base
-                if base in KEG_50:
-                    uom = "кега 50 л"
-                elif base in KEG_30:
-                    uom = "кега 30 л"
-                else:
-                    uom = ""
-            else:
-                name = name_part
-                uom = ""
-
-            # если есть слово "акция", определим промо
-            if "акци" in s_lower:
-                if name == "немецкое":
-                    promo = "3+1"
-                elif name in {"прага", "пшеничное"}:
-                    promo = "5+1"
-
-            items.append({
-                "shop": shop,
-                "name": name,
-                "uom": uom,
-                "qty": qty,
-                "promo": promo,
-                "comment": comment,
-            })
-            continue
+    is_promo = "promo" in found
+
+    # Немецкое 1, Бархатное 3, Жигули 2
+    m_basic = _BASIC_RE.search(s_lower)
+    if m_basic:
+        qty = int(m_basic.group(2))
+        if base:
+            name = base
+            uom = rules.keg_uom(base)
+        else:
+            name = m_basic.group(1).strip()
+            uom = ""
+        # если есть слово "акция", определим промо
+        promo = rules.promos.get(name, "") if is_promo else ""
+        return _item(shop, name, uom, qty, promo, comment)
+
+    # 'Немецкое акция' без количества -> 1
+    if is_promo:
+        name = base or s_lower
+        return _item(shop, name, rules.keg_uom(name), 1, rules.promos.get(name, ""), comment)
+
+    # Баллон углекислоты 1
+    if "cyl" in found and "углекислот" in s_lower:
+        m_q = _DIGITS_RE.search(s_lower)
+        qty = int(m_q.group(1)) if m_q else 1
+        return _item(shop, "Баллон углекислоты", "баллон", qty, comment=comment)
+
+    # если мы сюда дошли — не поняли строку, но сохраним для проверки
+    return _item(shop, raw, "", "", comment="нужна проверка")
+
+
+def _is_header_line(line: str) -> bool:
+    low = line.lower()
+    return "заявк" in low and "на" in low
+
+
+_STOP_KEYS = {normalize_shop(s) for s in STOP_LINES} - {""}
 
-        # 'Немецкое акция' без количества -> 1
-        if "акци" in s_lower:
-            base = _canon_drink(s_lower) or s_lower
-            qty = 1
-            if base == "немецкое":
-                promo = "3+1"
-            elif base in {"прага", "пшеничное"}:
-                promo = "5+1"
-            if base in KEG_50:
-                uom = "кега 50 л"
-            elif base in KEG_30:
-                uom = "кега 30 л"
-            items.append({
-                "shop": shop,
-                "name": base,
-                "uom": uom,
-                "qty": qty,
-                "promo": promo,
-                "comment": comment,
-            })
-            continue
 
-        # Баллон углекислоты 1
-        if "баллон" in s_lower and "углекислот" in s_lower:
-            m_q = re.search(r"(\d+)", s_lower)
-            qty = int(m_q.group(1)) if m_q else 1
-            items.append({
-                "shop": shop,
-                "name": "Баллон углекислоты",
-                "uom": "баллон",
-                "qty": qty,
-                "promo": "",
-                "comment": comment,
-            })
+def _is_service_line(line: str) -> bool:
+    """
+    Строка не может быть названием магазина: «заявки на ...», «Спасибо!»,
+    «Добрый день,», разделитель «-----», одни эмодзи.
+    """
+    if not any(ch.isalpha() for ch in line):
+        return True
+    return _is_header_line(line) or normalize_shop(line) in _STOP_KEYS
+
+
+def _is_product_line(line: str, rules: RuleSet | None = None) -> bool:
+    """Строка — узнаваемая позиция (а не название магазина)?"""
+    item = parse_line(line, rules=rules)
+    # у всех распознанных товаров есть ед. изм.; у магазина/мусора — нет
+    return bool(item and item["uom"])
+
+
+def _split_shop_blocks(text: str, rules: RuleSet | None = None) -> list[tuple[str, list[str]]]:
+    """
+    Делит сообщение на блоки по пустым строкам: (магазин, строки позиций).
+    Блок, который начинается с товара, продолжает предыдущий магазин.
+    """
+    blocks: list[list[str]] = [[]]
+    for ln in text.splitlines():
+        ln = ln.strip()
+        if ln:
+            blocks[-1].append(ln)
+        elif blocks[-1]:
+            blocks.append([])
+
+    result: list[tuple[str, list[str]]] = []
+    for block in blocks:
+        # служебные строки в начале блока: "заявки на ...", "добрый день", "-----"
+        while block and _is_service_line(block[0]):
+            block = block[1:]
+        if not block:
             continue
+        if result and _is_product_line(block[0], rules):
+            result[-1][1].extend(block)
+        else:
+            result.append((block[0], block[1:]))
+    return result
+
+
+def parse_message(
+    text: str,
+    current_shop: str | None = None,
+    order_date: str | None = None,
+    batch: bool = False,
+):
+    """
+    Простая, но рабочая логика:
+    - первая строка сообщения = название магазина
+    - остальные строки = позиции
 
-        # если мы сюда дошли — не поняли строку, но сохраним для проверки
-        items.append({
-            "shop": shop,
-            "name": raw,
-            "uom": "",
-            "qty": "",
-            "promo": "",
-            "comment": "нужна проверка",
-        })
+    batch=True: сообщение может содержать заявки нескольких магазинов,
+    разделённые пустыми строками (первая строка блока — магазин).
+    Если магазинов с позициями больше одного, вернётся
+    {"type": "batch", "order_date": ..., "orders": [заявка, ...]},
+    иначе — обычная одиночная заявка.
+    """
+    if not text:
+        return {"type": "unknown"}
+
+    # один снимок правил на всё сообщение, даже если его перезагрузят посреди разбора
+    rules = current_rules()
+
+    if batch:
+        orders = []
+        for shop, lines in _split_shop_blocks(text, rules):
+            items = [it for it in (parse_line(raw, shop, rules) for raw in lines) if it is not None]
+            if items:
+                orders.append({"type": "order", "shop": shop, "order_date": None, "items": items})
+        if len(orders) > 1:
+            order_date = order_date or normalize_order_date(text)
+            for o in orders:
+                o["order_date"] = order_date
+            return {"type": "batch", "order_date": order_date, "orders": orders}
+
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    if not lines:
+        return {"type": "unknown"}
+
+    # первая строка — магазин
+    shop = lines[0]
+    # иногда в первой строке могут написать "заявки на 06.11 ..." — отфильтруем
+    if "заявк" in shop.lower() and "на" in shop.lower() and len(lines) > 1:
+        shop = lines[1]
+        lines = lines[1:]
+    else:
+        lines = lines[1:]
+
+    if not order_date:
+        order_date = normalize_order_date(text)
+
+    items = []
+    for raw in lines:
+        item = parse_line(raw, shop, rules)
+        if item is not None:
+            items.append(item)
 
     if not items:
         return {"type": "unknown"}
@@ -1,7 +1,11 @@
 import os
-import psycopg2
+from collections import OrderedDict
 
-DB = os.getenv("DATABASE_URL")
+import asyncpg
+
+# кэш каталога: name_norm -> product_id (общий на процесс, LRU)
+PRODUCT_CACHE_MAX = int(os.getenv("PRODUCT_CACHE_MAX", "5000"))
+_PRODUCT_CACHE: "OrderedDict[str, int]" = OrderedDict()
 
 
 def normalize(text: str) -> str:
@@ -10,9 +14,55 @@ def normalize(text: str) -> str:
     return text.lower().strip().replace("ё", "е")
 
 
-def get_or_create_product(display_name: str, volume_l=None, pack_size: int = 1, promo_type: str | None = None):
+def _cache_get(name_norm: str) -> int | None:
+    pid = _PRODUCT_CACHE.get(name_norm)
+    if pid is not None:
+        _PRODUCT_CACHE.move_to_end(name_norm)
+    return pid
+
+
+def _cache_put(name_norm: str, pid: int) -> None:
+    _PRODUCT_CACHE[name_norm] = pid
+    _PRODUCT_CACHE.move_to_end(name_norm)
+    while len(_PRODUCT_CACHE) > PRODUCT_CACHE_MAX:
+        _PRODUCT_CACHE.popitem(last=False)
+
+
+def invalidate_product_cache(name: str | None = None) -> None:
+    """
+    Сбрасывает кэш товаров: целиком или только для одного названия.
+    Вызывать после ручных правок/удаления строк в products.
+    """
+    if name is None:
+        _PRODUCT_CACHE.clear()
+    else:
+        _PRODUCT_CACHE.pop(normalize(name), None)
+
+
+async def warm_product_cache(pool: asyncpg.Pool) -> int:
+    """
+    Загружает каталог в кэш при старте бота.
+    Возвращает количество загруженных товаров.
+    """
+    rows = await pool.fetch(
+        "SELECT id, name_norm FROM products ORDER BY id LIMIT $1",
+        PRODUCT_CACHE_MAX,
+    )
+    _PRODUCT_CACHE.clear()
+    for r in rows:
+        _cache_put(r["name_norm"], r["id"])
+    return len(rows)
+
+
+async def get_or_create_product(
+    pool: asyncpg.Pool,
+    display_name: str,
+    volume_l=None,
+    pack_size: int = 1,
+    promo_type: str | None = None,
+):
     """
-    Ищет продукт по name_norm. Если не найден — создаёт.
+    Ищет продукт по name_norm (сначала в кэше). Если не найден — создаёт.
     Возвращает product_id.
     """
     display_name = (display_name or "").strip()
@@ -20,30 +70,69 @@ def get_or_create_product(display_name: str, volume_l=None, pack_size: int = 1,
         return None
 
     name_norm = normalize(display_name)
+    pid = _cache_get(name_norm)
+    if pid is not None:
+        return pid
+
     pack_size = int(pack_size or 1)
 
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
+    # ON CONFLICT: две параллельные заявки с новым товаром не создадут дубль
+    pid = await pool.fetchval(
+        """
+        INSERT INTO products (name_norm, display_name, volume_l, pack_size, promo_type, active)
+        VALUES ($1, $2, $3, $4, $5, 1)
+        ON CONFLICT (name_norm) DO UPDATE SET name_norm = EXCLUDED.name_norm
+        RETURNING id
+        """,
+        name_norm, display_name, volume_l, pack_size, promo_type,
+    )
+    _cache_put(name_norm, pid)
+    return pid
 
-    cur.execute("SELECT id FROM products WHERE name_norm = %s", (name_norm,))
-    row = cur.fetchone()
-    if row:
-        pid = row[0]
-        cur.close()
-        conn.close()
-        return pid
 
-    cur.execute(
+async def get_or_create_products(conn: asyncpg.Connection, products: list[dict]) -> dict[str, int]:
+    """
+    Пакетный вариант get_or_create_product: товары из кэша не трогают БД,
+    остальные ищутся/создаются одним запросом.
+    products — словари с ключами display_name, volume_l, pack_size, promo_type.
+    Возвращает словарь name_norm -> product_id.
+    """
+    ids: dict[str, int] = {}
+    missing: dict[str, dict] = {}
+    for p in products:
+        display_name = (p.get("display_name") or "").strip()
+        if not display_name:
+            continue
+        name_norm = normalize(display_name)
+        if name_norm in ids or name_norm in missing:
+            continue
+        pid = _cache_get(name_norm)
+        if pid is not None:
+            ids[name_norm] = pid
+        else:
+            missing[name_norm] = {**p, "display_name": display_name}
+
+    if not missing:
+        return ids
+
+    names = list(missing)
+    rows = await conn.fetch(
         """
         INSERT INTO products (name_norm, display_name, volume_l, pack_size, promo_type, active)
-        VALUES (%s, %s, %s, %s, %s, 1)
-        RETURNING id
+        SELECT w.name_norm, w.display_name, w.volume_l, w.pack_size, w.promo_type, 1
+        FROM unnest($1::text[], $2::text[], $3::numeric[], $4::int[], $5::text[])
+            AS w(name_norm, display_name, volume_l, pack_size, promo_type)
+        ON CONFLICT (name_norm) DO UPDATE SET name_norm = EXCLUDED.name_norm
+        RETURNING id, name_norm
         """,
-        (name_norm, display_name, volume_l, pack_size, promo_type),
+        names,
+        [missing[n]["display_name"] for n in names],
+        [missing[n].get("volume_l") for n in names],
+        [int(missing[n].get("pack_size") or 1) for n in names],
+        [missing[n].get("promo_type") for n in names],
     )
 
-    pid = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
-    return pid
+    for r in rows:
+        ids[r["name_norm"]] = r["id"]
+        _cache_put(r["name_norm"], r["id"])
+    return ids
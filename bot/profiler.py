@@ -0,0 +1,101 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from typing import Awaitable, Callable
+
+from bot.scheduler import scheduler
+
+log = logging.getLogger(__name__)
+
+# сколько апдейтов можно профилировать за раз и сколько секунд максимум ждать
+PROFILE_MAX_UPDATES = int(os.getenv("PROFILE_MAX_UPDATES", "5000"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "900"))
+# сколько строк pstats попадает в отчёт
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "60"))
+
+Report = Callable[[str, int, float], Awaitable[None]]
+
+
+class ProfileSession:
+    """
+    cProfile на следующие N апдейтов живого трафика.
+    Профилируется весь event loop (все чаты, БД-вызовы, парсер); потоки
+    экспорта — нет. Пока сессии нет, профайлер не включён вовсе,
+    а планировщик проверяет только scheduler.observer is None.
+    """
+
+    def __init__(self, updates: int, report: Report):
+        self.updates = updates
+        self.report = report
+        # сама команда /profile тоже завершится через планировщик — её не считаем
+        self.seen = -1
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self._timeout: asyncio.TimerHandle | None = None
+
+    def start(self) -> None:
+        self.profile.enable()
+        scheduler.observer = self.on_update
+        self._timeout = asyncio.get_running_loop().call_later(PROFILE_MAX_SECONDS, self.finish)
+
+    def on_update(self) -> None:
+        self.seen += 1
+        if self.seen >= self.updates:
+            self.finish()
+
+    def finish(self) -> None:
+        global _SESSION
+        if _SESSION is not self:
+            return
+        self.profile.disable()
+        scheduler.observer = None
+        _SESSION = None
+        if self._timeout:
+            self._timeout.cancel()
+
+        elapsed = time.perf_counter() - self.started
+        task = asyncio.get_running_loop().create_task(
+            self.report(self.render(elapsed), max(self.seen, 0), elapsed)
+        )
+        _BACKGROUND.add(task)
+        task.add_done_callback(_BACKGROUND.discard)
+
+    def render(self, elapsed: float) -> str:
+        buf = io.StringIO()
+        buf.write(f"Профиль: {max(self.seen, 0)} апдейтов за {elapsed:.1f} с\n\n")
+        stats = pstats.Stats(self.profile, stream=buf)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_TOP)
+        buf.write("\n\n=== по собственному времени (tottime) ===\n")
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+        return buf.getvalue()
+
+
+_SESSION: ProfileSession | None = None
+_BACKGROUND: set[asyncio.Task] = set()
+
+
+def is_active() -> bool:
+    return _SESSION is not None
+
+
+def start_profile(updates: int, report: Report) -> bool:
+    """Запускает сессию; False — если уже идёт другая."""
+    global _SESSION
+    if _SESSION is not None:
+        return False
+    _SESSION = ProfileSession(min(updates, PROFILE_MAX_UPDATES), report)
+    _SESSION.start()
+    log.info("Профилирование включено на %s апдейтов", _SESSION.updates)
+    return True
+
+
+def stop_profile() -> bool:
+    """Досрочно завершает сессию (отчёт всё равно отправится)."""
+    if _SESSION is None:
+        return False
+    _SESSION.finish()
+    return True
@@ -0,0 +1,48 @@
+import os
+from collections import OrderedDict
+from datetime import date
+
+import asyncpg
+
+from bot.parser import to_date
+
+# сколько готовых отчётов держим в памяти (LRU)
+EXPORT_CACHE_MAX = int(os.getenv("EXPORT_CACHE_MAX", "32"))
+
+# (источник, дата) -> (версия, xlsx)
+_REPORTS: "OrderedDict[tuple, tuple[tuple, bytes]]" = OrderedDict()
+
+
+def _key_date(order_date) -> date:
+    return to_date(order_date) or date.today()
+
+
+async def current_version(pool: asyncpg.Pool, order_date) -> tuple[int, int]:
+    """
+    Версия данных за дату — из БД, а не из счётчика процесса: заявку мог
+    сохранить другой воркер. Заказ и его позиции пишутся одной транзакцией,
+    так что новый заказ = новая версия. Один запрос по индексу orders(order_date, shop_id).
+    """
+    row = await pool.fetchrow(
+        "SELECT count(*) AS n, COALESCE(max(id), 0) AS last_id FROM orders WHERE order_date = $1",
+        _key_date(order_date),
+    )
+    return row["n"], row["last_id"]
+
+
+def get_report(source: str, order_date, version: tuple) -> bytes | None:
+    """Готовый отчёт, если он собран для этой же версии даты."""
+    key = (source, _key_date(order_date))
+    cached = _REPORTS.get(key)
+    if cached is None or cached[0] != version:
+        return None
+    _REPORTS.move_to_end(key)
+    return cached[1]
+
+
+def put_report(source: str, order_date, version: tuple, data: bytes) -> None:
+    key = (source, _key_date(order_date))
+    _REPORTS[key] = (version, data)
+    _REPORTS.move_to_end(key)
+    while len(_REPORTS) > EXPORT_CACHE_MAX:
+        _REPORTS.popitem(last=False)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.metrics import Gauge, QUEUE_WAIT_SECONDS, UPDATE_SECONDS
+
+log = logging.getLogger(__name__)
+
+# сколько апдейтов (из разных чатов) обрабатывается одновременно
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "32"))
+
+Handler = Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]]
+
+
+class ChatScheduler(BaseMiddleware):
+    """
+    Планировщик апдейтов уровня диспетчера (outer middleware на dp.update).
+
+    Апдейты одного чата выполняются строго по очереди, в порядке поступления:
+    «заявки на 05.11» всегда обработается раньше следующей за ним заявки,
+    а шаги 🧾 Заявки не обгоняют друг друга. Разные чаты идут параллельно,
+    но не больше concurrency обработчиков одновременно.
+
+    Middleware только ставит апдейт в очередь чата и сразу возвращается,
+    поэтому polling/вебхук не ждут медленные обработчики.
+    """
+
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY):
+        self.concurrency = concurrency
+        self._sem = asyncio.Semaphore(concurrency)
+        self._queues: dict[int, deque] = {}
+        self._workers: dict[int | None, set[asyncio.Task]] = {}
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        # вызывается после каждого апдейта, пока идёт /profile (bot/profiler.py)
+        self.observer: Callable[[], None] | None = None
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        chat = data.get("event_chat")
+        self.submit(chat.id if chat else None, handler, event, data)
+        return None
+
+    def submit(self, chat_id: int | None, handler: Handler, event: TelegramObject, data: dict) -> None:
+        """Ставит апдейт в очередь чата (без чата — выполняется сразу, без очереди)."""
+        received = time.perf_counter()
+        if chat_id is None:
+            self._spawn(None, self._run(handler, event, data, received))
+            return
+
+        q = self._queues.get(chat_id)
+        if q is None:
+            q = self._queues[chat_id] = deque()
+        q.append((handler, event, data, received))
+        self.max_depth = max(self.max_depth, len(q))
+
+        if chat_id not in self._workers:
+            self._spawn(chat_id, self._drain(chat_id, q))
+
+    def _spawn(self, key: int | None, coro) -> None:
+        task = asyncio.create_task(coro)
+        tasks = self._workers.setdefault(key, set())
+        tasks.add(task)
+
+        def done(t: asyncio.Task) -> None:
+            tasks.discard(t)
+            # воркер чата уже снял себя в _drain; не трогаем запись нового воркера
+            if not tasks and self._workers.get(key) is tasks:
+                self._workers.pop(key, None)
+
+        task.add_done_callback(done)
+
+    async def _drain(self, chat_id: int, q: deque) -> None:
+        try:
+            while q:
+                handler, event, data, received = q[0]
+                await self._run(handler, event, data, received)
+                q.popleft()
+        finally:
+            # снимаем воркер сразу, без await: иначе апдейт, пришедший до done-callback,
+            # попадёт в новую очередь, увидит «живой» воркер и останется без обработки
+            self._workers.pop(chat_id, None)
+            if not q:
+                self._queues.pop(chat_id, None)
+
+    async def _run(self, handler: Handler, event: TelegramObject, data: dict, received: float) -> None:
+        async with self._sem:
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - received)
+            self.running += 1
+            try:
+                await handler(event, data)
+            except Exception:
+                self.failed += 1
+                log.exception("Ошибка в обработчике апдейта")
+            finally:
+                self.running -= 1
+                self.processed += 1
+                UPDATE_SECONDS.observe(time.perf_counter() - received)
+                if self.observer is not None:
+                    self.observer()
+
+    # === метрики ===
+
+    def queue_depths(self) -> dict[int, int]:
+        """chat_id -> сколько апдейтов ждёт (включая выполняемый)."""
+        return {chat_id: len(q) for chat_id, q in self._queues.items() if q}
+
+    def hot_chats(self, limit: int = 10) -> list[tuple[int, int]]:
+        return sorted(self.queue_depths().items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+    def stats(self) -> dict[str, int]:
+        depths = self.queue_depths()
+        return {
+            "chats_active": len(depths),
+            "pending": sum(depths.values()),
+            "running": self.running,
+            "processed": self.processed,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+        }
+
+    async def wait_idle(self, timeout: float | None = None) -> None:
+        """Дождаться обработки уже принятых апдейтов (при остановке бота)."""
+        tasks = [t for ts in self._workers.values() for t in ts]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+scheduler = ChatScheduler()
+
+Gauge("favobot_scheduler_pending", "Апдейтов в очередях чатов", lambda: scheduler.stats()["pending"])
+Gauge("favobot_scheduler_running", "Обработчиков выполняется сейчас", lambda: scheduler.running)
+Gauge("favobot_scheduler_failed", "Апдейтов, упавших с ошибкой", lambda: scheduler.failed)
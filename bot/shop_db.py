@@ -1,106 +1,266 @@
-import os
-import psycopg2
-import datetime
+import logging
+import re
 
-DB = os.getenv("DATABASE_URL")
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# индекс псевдонимов: нормализованное имя/вариант -> shop_id
+_SHOP_ALIASES: dict[str, int] = {}
+# shop_id -> (name, normalized)
+_SHOPS: dict[int, tuple[str, str]] = {}
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_VARIANTS_SPLIT_RE = re.compile(r"[;\n|]+")
 
 
 def normalize(text: str) -> str:
     """Приводим строку к нормальному виду для поиска."""
     if not text:
         return ""
-    return text.lower().strip().replace("ё", "е")
+    text = text.lower().replace("ё", "е")
+    # кавычки, точки, лишние пробелы — не повод заводить новый магазин
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+
+def split_variants(variants: str | None) -> list[str]:
+    """Колонка shops.variants: варианты названия через ';', '|' или с новой строки."""
+    if not variants:
+        return []
+    return [v.strip() for v in _VARIANTS_SPLIT_RE.split(variants) if v.strip()]
+
 
+def _index_shop(shop_id: int, name: str, normalized: str, variants: str | None = None) -> None:
+    _SHOPS[shop_id] = (name, normalized)
+    for alias in (name, normalized, *split_variants(variants)):
+        key = normalize(alias)
+        if key:
+            _SHOP_ALIASES.setdefault(key, shop_id)
 
-def find_shop(name: str):
+
+async def load_shop_index(pool: asyncpg.Pool) -> int:
+    """
+    Загружает справочник магазинов (имена + варианты) в память.
+    Вызывается один раз при старте. Возвращает количество магазинов.
+    """
+    rows = await pool.fetch("SELECT id, name, normalized, variants FROM shops ORDER BY id")
+    _SHOP_ALIASES.clear()
+    _SHOPS.clear()
+    for r in rows:
+        _index_shop(r["id"], r["name"], r["normalized"], r["variants"])
+    return len(rows)
+
+
+async def find_shop(pool: asyncpg.Pool, name: str):
     """
-    Ищем магазин по нормализованному имени или полному.
-    Возвращает tuple (id, name, normalized) или None.
+    Ищем магазин по нормализованному имени или варианту.
+    Сначала в индексе в памяти, при промахе — по уникальному индексу в БД
+    (магазин мог добавить другой процесс).
+    Возвращает (id, name, normalized) или None.
     """
     if not name:
         return None
 
     name_n = normalize(name)
+    shop_id = _SHOP_ALIASES.get(name_n)
+    if shop_id is not None:
+        return (shop_id, *_SHOPS[shop_id])
 
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
-
-    cur.execute(
+    row = await pool.fetchrow(
         """
-        SELECT id, name, normalized
+        SELECT id, name, normalized, variants
         FROM shops
-        WHERE normalized = %s OR name = %s
+        WHERE normalized = $1
         """,
-        (name_n, name.strip()),
+        name_n,
     )
+    if not row:
+        return None
 
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row
+    _index_shop(row["id"], row["name"], row["normalized"], row["variants"])
+    _SHOP_ALIASES[name_n] = row["id"]
+    return (row["id"], row["name"], row["normalized"])
 
 
-def add_shop(name: str):
+async def add_shop(pool: asyncpg.Pool, name: str):
     name = (name or "").strip()
     if not name:
         return None
 
-    exists = find_shop(name)
-    if exists:
-        return exists[0]
-
     name_n = normalize(name)
 
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
-
-    cur.execute(
+    # ON CONFLICT: если магазин уже есть (или его только что вставили параллельно) — вернём его id
+    row = await pool.fetchrow(
         """
         INSERT INTO shops (name, normalized)
-        VALUES (%s, %s)
-        RETURNING id
+        VALUES ($1, $2)
+        ON CONFLICT (normalized) DO UPDATE SET normalized = EXCLUDED.normalized
+        RETURNING id, name, normalized, variants, (xmax = 0) AS inserted
         """,
-        (name, name_n),
+        name, name_n,
     )
 
-    shop_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
+    _index_shop(row["id"], row["name"], row["normalized"], row["variants"])
+    if row["inserted"]:
+        log.info("📒 [+] Added shop: %s (id=%s)", name, row["id"])
+    return row["id"]
 
-    print(f"📒 [+] Added shop: {name} (id={shop_id})")
-    return shop_id
 
 
-
-def get_or_create_shop(name: str):
+async def get_or_create_shop(pool: asyncpg.Pool, name: str):
     """
     Возвращает ID магазина.
+    Известный магазин находится в памяти без запроса к БД.
     Если не найден — создаёт.
     """
-    row = find_shop(name)
-    if row:
-        return row[0]
-    return add_shop(name)
+    shop_id = _SHOP_ALIASES.get(normalize(name))
+    if shop_id is not None:
+        return shop_id
+    return await add_shop(pool, name)
 
 
-def list_shops():
-    """Возвращает список всех магазинов в виде словарей."""
-    conn = psycopg2.connect(DB)
-    cur = conn.cursor()
+async def get_or_create_shops(
+    pool: asyncpg.Pool | asyncpg.Connection,
+    names: list[str],
+    created: set[int] | None = None,
+) -> dict[str, int]:
+    """
+    Пакетный get_or_create_shop для сообщения с заявками многих магазинов.
+    Известные магазины берутся из индекса, новые создаются одним запросом
+    (можно передать соединение с открытой транзакцией). Названия, пустые
+    после normalize(), пропускаются. Возвращает словарь normalize(name) -> shop_id;
+    id вставленных магазинов добавляются в created.
+    """
+    ids: dict[str, int] = {}
+    missing: dict[str, str] = {}
+    for name in names:
+        name = (name or "").strip()
+        key = normalize(name)
+        if not key or key in ids or key in missing:
+            continue
+        shop_id = _SHOP_ALIASES.get(key)
+        if shop_id is not None:
+            ids[key] = shop_id
+        else:
+            missing[key] = name
 
-    cur.execute(
+    if not missing:
+        return ids
+
+    rows = await pool.fetch(
         """
-        SELECT id, name, active, date_added
-        FROM shops
-        ORDER BY name
+        INSERT INTO shops (name, normalized)
+        SELECT * FROM unnest($1::text[], $2::text[])
+        ON CONFLICT (normalized) DO UPDATE SET normalized = EXCLUDED.normalized
+        RETURNING id, name, normalized, variants, (xmax = 0) AS inserted
+        """,
+        list(missing.values()), list(missing),
+    )
+    for r in rows:
+        _index_shop(r["id"], r["name"], r["normalized"], r["variants"])
+        ids[r["normalized"]] = r["id"]
+        if r["inserted"]:
+            log.info("📒 [+] Added shop: %s (id=%s)", r["name"], r["id"])
+            if created is not None:
+                created.add(r["id"])
+    return ids
+
+
+def forget_shops(shop_ids) -> None:
+    """Убирает магазины из индекса (например, созданные в откатившейся транзакции)."""
+    ids = set(shop_ids)
+    if not ids:
+        return
+    for shop_id in ids:
+        _SHOPS.pop(shop_id, None)
+    for key in [k for k, shop_id in _SHOP_ALIASES.items() if shop_id in ids]:
+        del _SHOP_ALIASES[key]
+
+
+async def add_shop_variant(pool: asyncpg.Pool, shop_id: int, variant: str) -> bool:
+    """
+    Добавляет вариант написания к магазину (колонка variants) и в индекс.
+    Возвращает False, если магазина нет или вариант уже занят другим магазином.
+    """
+    key = normalize(variant)
+    if not key:
+        return False
+    owner = _SHOP_ALIASES.get(key)
+    if owner is not None:
+        return owner == shop_id
+
+    row = await pool.fetchrow(
         """
+        UPDATE shops
+        SET variants = CASE
+            WHEN variants IS NULL OR variants = '' THEN $2
+            ELSE variants || ';' || $2
+        END
+        WHERE id = $1
+        RETURNING id, name, normalized, variants
+        """,
+        shop_id, variant.strip(),
     )
+    if not row:
+        return False
+
+    _index_shop(row["id"], row["name"], row["normalized"], row["variants"])
+    return True
+
 
-    rows = cur.fetchall()
-    conn.close()
+# сколько магазинов на странице /shops
+SHOPS_PAGE_SIZE = 20
+
+# поиск по префиксу — диапазон [prefix, prefix + максимальный символ) в порядке "C"
+_PREFIX_END = chr(0x10FFFF)
+
+
+async def list_shops_page(
+    pool: asyncpg.Pool,
+    limit: int = SHOPS_PAGE_SIZE,
+    after_id: int | None = None,
+    before_id: int | None = None,
+    prefix: str = "",
+) -> tuple[list[dict], bool]:
+    """
+    Страница справочника магазинов (keyset-пагинация), один индексный запрос.
+    Без поиска — порядок (name, id), с поиском — (normalized, id) по префиксу
+    normalize(prefix). after_id/before_id — id магазина на границе соседней
+    страницы: его ключ сортировки берётся подзапросом по первичному ключу.
+    Возвращает (магазины, есть ли ещё магазины дальше в направлении листания).
+    """
+    key = 'normalized COLLATE "C"' if prefix else "name"
+    backward = before_id is not None
+    cursor_id = before_id if backward else after_id
+
+    where = []
+    args: list = [limit + 1]
+    if prefix:
+        args += [prefix, prefix + _PREFIX_END]
+        where.append(f"{key} >= $2 AND {key} < $3")
+    if cursor_id is not None:
+        args.append(cursor_id)
+        n = len(args)
+        op = "<" if backward else ">"
+        where.append(f"({key}, id) {op} ((SELECT {key} FROM shops WHERE id = ${n}), ${n})")
+
+    order = "DESC" if backward else "ASC"
+    rows = await pool.fetch(
+        f"""
+        SELECT id, name, active, date_added
+        FROM shops
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {key} {order}, id {order}
+        LIMIT $1
+        """,
+        *args,
+    )
 
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
     return [
-        {"id": r[0], "name": r[1], "active": r[2], "date": r[3]}
+        {"id": r["id"], "name": r["name"], "active": r["active"], "date": r["date_added"]}
         for r in rows
-    ]
+    ], more
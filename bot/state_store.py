@@ -0,0 +1,135 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any
+
+import asyncpg
+
+# namespace'ы состояния диалогов
+FORM = "form"              # шаги 🧾 Заявки: user_id -> dict
+ORDER_DATE = "order_date"  # дата из «заявки на ...»: chat_id -> "ДД.ММ.ГГГГ"
+
+# сколько живёт состояние без обновлений (сек)
+STATE_TTL = {
+    FORM: int(os.getenv("FORM_STATE_TTL", str(6 * 3600))),
+    ORDER_DATE: int(os.getenv("ORDER_DATE_TTL", str(48 * 3600))),
+}
+DEFAULT_TTL = 24 * 3600
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+# memory — только в процессе; postgres — таблица dialog_state, общая для воркеров
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+
+
+class MemoryStateStore:
+    """
+    Состояние диалогов в памяти процесса.
+    Записи живут ttl секунд с последнего обновления, всего не больше max_size
+    (самые давно обновлённые вытесняются первыми).
+    """
+
+    def __init__(self, ttl: dict[str, int] | None = None, max_size: int = STATE_MAX_ENTRIES):
+        self.ttl = ttl if ttl is not None else STATE_TTL
+        self.max_size = max_size
+        # (namespace, key) -> (expires_at, value); порядок = порядок обновления
+        self._data: "OrderedDict[tuple[str, str], tuple[float, Any]]" = OrderedDict()
+
+    def _ttl(self, namespace: str) -> int:
+        return self.ttl.get(namespace, DEFAULT_TTL)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._data:
+            k, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now and len(self._data) <= self.max_size:
+                break
+            del self._data[k]
+
+    async def get(self, namespace: str, key) -> Any | None:
+        k = (namespace, str(key))
+        entry = self._data.get(k)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._data[k]
+            return None
+        return entry[1]
+
+    async def set(self, namespace: str, key, value: Any, ttl: float | None = None) -> None:
+        k = (namespace, str(key))
+        self._data[k] = (time.monotonic() + (ttl if ttl is not None else self._ttl(namespace)), value)
+        self._data.move_to_end(k)
+        self._evict()
+
+    async def delete(self, namespace: str, key) -> None:
+        self._data.pop((namespace, str(key)), None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class PgStateStore:
+    """
+    Состояние диалогов в Postgres (таблица dialog_state).
+    Переживает перезапуски и общее для всех воркеров: шаг 🧾 Заявки, сделанный
+    на одном воркере, следующий апдейт видит на любом другом. Поэтому кэша
+    в процессе нет — каждое чтение идёт в БД по первичному ключу.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, ttl: dict[str, int] | None = None):
+        self.pool = pool
+        self.ttl = ttl if ttl is not None else STATE_TTL
+        self._writes = 0
+
+    def _ttl(self, namespace: str) -> int:
+        return self.ttl.get(namespace, DEFAULT_TTL)
+
+    async def get(self, namespace: str, key) -> Any | None:
+        raw = await self.pool.fetchval(
+            """
+            SELECT value
+            FROM dialog_state
+            WHERE namespace = $1 AND key = $2
+              AND updated_at > now() - make_interval(secs => $3)
+            """,
+            namespace, str(key), self._ttl(namespace),
+        )
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, namespace: str, key, value: Any) -> None:
+        await self.pool.execute(
+            """
+            INSERT INTO dialog_state (namespace, key, value, updated_at)
+            VALUES ($1, $2, $3::jsonb, now())
+            ON CONFLICT (namespace, key)
+            DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+            """,
+            namespace, str(key), json.dumps(value, ensure_ascii=False),
+        )
+
+        # время от времени чистим протухшие диалоги
+        self._writes += 1
+        if self._writes % 500 == 0:
+            await self.purge_expired()
+
+    async def delete(self, namespace: str, key) -> None:
+        await self.pool.execute(
+            "DELETE FROM dialog_state WHERE namespace = $1 AND key = $2",
+            namespace, str(key),
+        )
+
+    async def purge_expired(self) -> None:
+        for namespace, ttl in self.ttl.items():
+            await self.pool.execute(
+                "DELETE FROM dialog_state WHERE namespace = $1 AND updated_at < now() - make_interval(secs => $2)",
+                namespace, ttl,
+            )
+
+
+def create_state_store(pool: asyncpg.Pool | None = None):
+    """Хранилище по STATE_BACKEND: memory (по умолчанию) или postgres."""
+    if STATE_BACKEND == "postgres":
+        if pool is None:
+            raise RuntimeError("STATE_BACKEND=postgres требует пул БД")
+        return PgStateStore(pool)
+    return MemoryStateStore()
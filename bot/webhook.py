@@ -0,0 +1,78 @@
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = "/webhook",
+    secret: str | None = None,
+) -> web.Application:
+    """
+    aiohttp-приложение для приёма апдейтов от Telegram.
+    feed_update только ставит апдейт в очередь чата (bot/scheduler.py) и сразу
+    возвращается, поэтому ответ 200 не ждёт обработчик. Сколько апдейтов
+    обрабатывается одновременно, ограничивает SCHEDULER_CONCURRENCY.
+    Локально проверяется обычным POST с JSON апдейта (см. README).
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception:
+            log.warning("Не удалось разобрать апдейт из вебхука")
+            return web.Response(status=400)
+
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            log.exception("Ошибка обработки апдейта %s", update.update_id)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    secret: str | None = None,
+    public_url: str | None = None,
+) -> None:
+    """
+    Поднимает сервер вебхука и работает до отмены.
+    Если задан public_url — регистрирует вебхук в Telegram.
+    """
+    app = build_app(dp, bot, path=path, secret=secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    log.info("Вебхук слушает http://%s:%s%s", host, port, path)
+
+    if public_url:
+        await bot.set_webhook(public_url.rstrip("/") + path, secret_token=secret)
+        log.info("Вебхук зарегистрирован: %s%s", public_url.rstrip("/"), path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
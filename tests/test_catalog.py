@@ -0,0 +1,64 @@
+import pytest
+
+from bench.bench_parser import load_corpus
+from bot import catalog
+from bot.catalog import DEFAULT_RULES, RuleSet
+from bot.parser import parse_line
+
+
+def _both(rules, monkeypatch):
+    """Один и тот же каталог: со сканом регуляркой и со сканом автоматом."""
+    monkeypatch.setattr(catalog, "AUTOMATON_MIN_FEATURES", 10**9)
+    by_regex = RuleSet(rules)
+    monkeypatch.setattr(catalog, "AUTOMATON_MIN_FEATURES", 0)
+    by_automaton = RuleSet(rules)
+    assert by_regex.automaton is None and by_automaton.automaton is not None
+    return by_regex, by_automaton
+
+
+@pytest.mark.parametrize("line, canon", [
+    ("жигули 2", "жигули"),
+    ("немецкое акция 3", "немецкое"),
+    ("бархатное 60 л", "бархатное"),
+    ("бархатное янтарное 2", "бархатное янтарное"),
+    ("янтарное бархатное 2", "бархатное янтарное"),
+    ("жигулибархатное", "жигули"),
+    ("пэт 1,5 л - 2", None),
+    ("магнит абая", None),
+])
+def test_canon_is_the_same_for_regex_and_automaton(line, canon, monkeypatch):
+    for rules in _both(DEFAULT_RULES, monkeypatch):
+        assert rules.canon_from_features(rules.scan(line)) == canon
+
+
+def test_covering_rule_wins_whatever_the_priority(monkeypatch):
+    """«бархат»+«янтар» сильнее «бархат», даже если у «бархатного» приоритет выше."""
+    rules = [
+        ("бархатное", ["бархат"], 1, 30, None, None, None),
+        ("бархатное янтарное", ["бархат", "янтар"], 2, 30, None, None, None),
+    ]
+    for ruleset in _both(rules, monkeypatch):
+        assert ruleset.canon_from_features(ruleset.scan("бархатное 2")) == "бархатное"
+        for line in ("бархатное янтарное 2", "янтарное бархатное 2", "бархатноеянтарное 2"):
+            assert ruleset.canon_from_features(ruleset.scan(line)) == "бархатное янтарное"
+
+
+def test_scanners_agree_on_corpus_lines(monkeypatch):
+    by_regex, by_automaton = _both(DEFAULT_RULES, monkeypatch)
+    lines = {ln.strip().lower() for msg in load_corpus() for ln in msg.splitlines() if ln.strip()}
+    for line in sorted(lines):
+        assert by_regex.scan(line) == by_automaton.scan(line), line
+        assert parse_line(line, rules=by_regex) == parse_line(line, rules=by_automaton), line
+
+
+def test_large_catalog_uses_automaton_and_matches_regex(monkeypatch):
+    rules = DEFAULT_RULES + [
+        (f"сорт {i}", [f"сорт{i:04d}"], 100 + i, 30, None, None, None) for i in range(2000)
+    ]
+    assert RuleSet(rules).automaton is not None
+    by_regex, by_automaton = _both(rules, monkeypatch)
+    for line in ("сорт0042 3", "сорт1999 бархатное 1", "жигули 50 л", "сорт0007сорт0008 1"):
+        expected = by_regex.canon_from_features(by_regex.scan(line))
+        assert by_automaton.canon_from_features(by_automaton.scan(line)) == expected
+        assert parse_line(line, rules=by_automaton) == parse_line(line, rules=by_regex)
+    assert by_automaton.canon_from_features(by_automaton.scan("сорт0042 3")) == "сорт 42"
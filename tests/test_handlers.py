@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot import handlers
+from bot.state_store import ORDER_DATE, MemoryStateStore
+
+
+def _message(text):
+    return SimpleNamespace(
+        text=text,
+        message_id=7,
+        chat=SimpleNamespace(id=100),
+        from_user=SimpleNamespace(id=1),
+    )
+
+
+def _handle(monkeypatch, text):
+    """Прогоняет handle_text без БД и Telegram: что сохранено, что ответили."""
+    saved, replies = [], []
+
+    async def get_or_create_shops(db, names, created=None):
+        return {handlers.normalize_shop(n): i for i, n in enumerate(names, 1)}
+
+    async def save_orders(db, chat_id, message_id, order_date, orders):
+        saved.append((order_date, orders))
+
+    async def save_order(db, shop_id, chat_id, message_id, order_date, items):
+        saved.append((order_date, [(shop_id, items)]))
+
+    async def get_or_create_shop(db, name):
+        return 1
+
+    monkeypatch.setattr(handlers, "get_or_create_shops", get_or_create_shops)
+    monkeypatch.setattr(handlers, "get_or_create_shop", get_or_create_shop)
+    monkeypatch.setattr(handlers, "save_orders", save_orders)
+    monkeypatch.setattr(handlers, "save_order", save_order)
+    monkeypatch.setattr(handlers, "reply", lambda msg, text, **kw: replies.append(text))
+
+    dialogs = MemoryStateStore()
+    asyncio.run(handlers.handle_text(_message(text), None, dialogs))
+    return saved, replies, asyncio.run(dialogs.get(ORDER_DATE, 100))
+
+
+def test_header_with_orders_saves_batch(monkeypatch):
+    text = "заявки на 06.11.2025\n\nМагнит Абая\nЖигули 2\n\nАнвар\nКвас 1"
+    saved, replies, order_date = _handle(monkeypatch, text)
+
+    assert order_date == "06.11.2025"
+    assert len(saved) == 1
+    batch_date, orders = saved[0]
+    assert batch_date == "06.11.2025"
+    assert [[it["name"] for it in items] for _, items in orders] == [["жигули"], ["квас"]]
+    assert replies[0].startswith("📦 Принято заявок: 2")
+
+
+def test_header_only_sets_order_date(monkeypatch):
+    saved, replies, order_date = _handle(monkeypatch, "Заявки на 06.11.2025 принимаем до 12:00")
+
+    assert saved == []
+    assert order_date == "06.11.2025"
+    assert replies == ["📅 Принял. Дата заявок: 06.11.2025"]
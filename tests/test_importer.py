@@ -0,0 +1,22 @@
+from datetime import date
+
+from bot.importer import parse_row
+
+COLUMNS = {"shop": 0, "product": 1, "qty": 2}
+DAY = date(2025, 11, 6)
+
+
+def _qty(row):
+    parsed, reason = parse_row(row, COLUMNS, DAY)
+    return parsed[2]["qty"] if parsed else reason
+
+
+def test_qty_column_applies_to_product_with_liters():
+    assert _qty(["Магнит", "Жигули 50 л", 2]) == 2
+    assert _qty(["Магнит", "Жигули 50 л", None]) == 1
+    assert _qty(["Магнит", "Жигули", 2]) == 2
+
+
+def test_ambiguous_or_zero_qty_goes_to_review():
+    assert _qty(["Магнит", "Жигули 100 л", 2]) == "количество и в товаре, и в колонке"
+    assert _qty(["Магнит", "Жигули", "0"]) == "нулевое количество"
@@ -0,0 +1,17 @@
+from bot.parser import parse_message
+
+
+def _shops(text):
+    result = parse_message(text, batch=True)
+    orders = result["orders"] if result["type"] == "batch" else [result]
+    return [o["shop"] for o in orders]
+
+
+def test_separator_and_emoji_lines_are_not_shops():
+    assert _shops("Магнит Абая\nЖигули 2\n\n-----\nПрага 1") == ["Магнит Абая"]
+    assert _shops("Магнит\nЖигули 2\n\n🍺🍺\nЛимонад 1\n\nАнвар\nПрага 1") == ["Магнит", "Анвар"]
+
+
+def test_stop_lines_with_punctuation_are_not_shops():
+    text = "Магнит Абая\nЖигули 2\n\nСпасибо!\n\nДобрый день,\nАнвар\nКвас 1"
+    assert _shops(text) == ["Магнит Абая", "Анвар"]
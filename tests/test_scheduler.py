@@ -0,0 +1,47 @@
+import asyncio
+
+from bot.scheduler import ChatScheduler
+
+
+def test_update_submitted_while_worker_exits_is_processed():
+    """Апдейт, пришедший между концом _drain и done-callback воркера, не теряется."""
+
+    async def scenario():
+        sched = ChatScheduler(concurrency=4)
+        handled = []
+
+        async def second(event, data):
+            handled.append(event)
+
+        async def first(event, data):
+            handled.append(event)
+            # сработает, когда _drain уже вышел, а done-callback задачи ещё не вызван
+            asyncio.get_running_loop().call_soon(sched.submit, 1, second, "second", {})
+
+        sched.submit(1, first, "first", {})
+        await asyncio.sleep(0.05)
+        await sched.wait_idle(timeout=1)
+        return sched, handled
+
+    sched, handled = asyncio.run(scenario())
+    assert handled == ["first", "second"]
+    assert sched.queue_depths() == {}
+    assert sched._workers == {}
+
+
+def test_chat_updates_run_in_order():
+    async def scenario():
+        sched = ChatScheduler(concurrency=4)
+        handled = []
+
+        async def handler(event, data):
+            await asyncio.sleep(0.001 * (3 - event))
+            handled.append(event)
+
+        for i in range(3):
+            sched.submit(1, handler, i, {})
+        await asyncio.sleep(0.05)
+        await sched.wait_idle(timeout=1)
+        return handled
+
+    assert asyncio.run(scenario()) == [0, 1, 2]